@@ -201,7 +201,8 @@ module_list = [
 hz_confile_list = [
     'config/idem-template-metadata.xml',
     'config/logging.conf',
-    'config/actions.conf'
+    'config/actions.conf',
+    'config/cloudvenetod.conf'
 ]
 
 setup(
@@ -230,6 +231,7 @@ setup(
                   (theme_dir + '/static/img', ['src/templates/favicon.ico']),
                   ('etc/openstack-auth-shib', hz_confile_list),
                   ('etc/cron.d', ['config/openstack-auth-shib-cron']),
+                  ('usr/lib/systemd/system', ['config/cloudvenetod.service']),
                   ('usr/share/openstack-auth-shib', ['config/attribute-map.xml']),
                   ('etc/openstack-auth-shib/notifications', ['config/notifications_en.txt']),
                   (theme_dir + '/static', 
@@ -0,0 +1,166 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import logging
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from django.db import router
+from django.db import transaction
+from django.core.management.base import CommandError
+
+from openstack_auth_shib.models import Registration
+from openstack_auth_shib.models import Project
+from openstack_auth_shib.models import Expiration
+from openstack_auth_shib.models import PrjRequest
+from openstack_auth_shib.models import RegRequest
+from openstack_auth_shib.models import PRJ_PRIVATE
+from openstack_auth_shib.models import PSTATUS_PENDING
+from openstack_auth_shib.models import PSTATUS_RENEW_DISC
+from openstack_auth_shib.models import RSTATUS_PENDING
+from openstack_auth_shib.models import orphan_registrations
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("benchorphans")
+
+BENCH_PREFIX = 'bench-orphans-'
+
+#
+# Benchmark of the orphan detection: the legacy set based query (ids loaded
+# in memory and passed back in a NOT IN clause) against orphan_registrations().
+# The synthetic registrations are created in a transaction which is always
+# rolled back, the database is not modified.
+#
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--registrations',
+                            dest='n_regs',
+                            action='store',
+                            type=int,
+                            default=100000,
+                            help='Number of synthetic registrations')
+        parser.add_argument('--repeat',
+                            dest='repeat',
+                            action='store',
+                            type=int,
+                            default=3,
+                            help='Number of runs for each query')
+        parser.add_argument('--batch-size',
+                            dest='batch_size',
+                            action='store',
+                            type=int,
+                            default=1000,
+                            help='Batch size for the synthetic data')
+
+    def populate(self, n_regs, batch_size):
+        exp_date = datetime.now(timezone.utc) + timedelta(365)
+
+        prj = Project.objects.create(projectname=BENCH_PREFIX + 'project',
+                                     description='benchmark', status=PRJ_PRIVATE)
+
+        Registration.objects.bulk_create([
+            Registration(username="%s%d" % (BENCH_PREFIX, idx),
+                         userid="%s%d" % (BENCH_PREFIX, idx),
+                         givenname='-', sn='-', organization='-',
+                         phone='-', domain='default', expdate=exp_date)
+            for idx in range(n_regs)
+        ], batch_size=batch_size)
+
+        regs = Registration.objects.filter(username__startswith=BENCH_PREFIX).order_by('regid')
+        exp_list = list()
+        prq_list = list()
+        rrq_list = list()
+
+        # 1/2 active, 1/8 project requests, 1/8 discarded renewals,
+        # 1/16 registration requests, the others are orphans
+        for idx, reg_item in enumerate(regs.iterator()):
+            slot = idx % 16
+            if slot < 8:
+                exp_list.append(Expiration(registration=reg_item, project=prj, expdate=exp_date))
+            elif slot < 10:
+                prq_list.append(PrjRequest(registration=reg_item, project=prj,
+                                           flowstatus=PSTATUS_PENDING, notes='-'))
+            elif slot < 12:
+                prq_list.append(PrjRequest(registration=reg_item, project=prj,
+                                           flowstatus=PSTATUS_RENEW_DISC, notes='-'))
+            elif slot < 13:
+                rrq_list.append(RegRequest(registration=reg_item, email='-',
+                                           flowstatus=RSTATUS_PENDING, notes='-'))
+
+        Expiration.objects.bulk_create(exp_list, batch_size=batch_size)
+        PrjRequest.objects.bulk_create(prq_list, batch_size=batch_size)
+        RegRequest.objects.bulk_create(rrq_list, batch_size=batch_size)
+
+    def legacy_query(self):
+        qset1 = RegRequest.objects.all()
+        pend_orphans = set(qset1.values_list('registration', flat = True).distinct())
+
+        qset2 = Expiration.objects.all()
+        act_users = set(qset2.values_list('registration', flat = True).distinct())
+
+        qset3 = PrjRequest.objects.exclude(flowstatus = PSTATUS_RENEW_DISC)
+        pend_prjusr = set(qset3.values_list('registration', flat = True).distinct())
+
+        excl_set = pend_orphans | act_users | pend_prjusr
+        return len(Registration.objects.exclude(regid__in = excl_set).values_list('regid', flat = True))
+
+    def exists_query(self):
+        qset = orphan_registrations(with_regrequests = True)
+        return len(qset.values_list('regid', flat = True))
+
+    def run_bench(self, label, query, repeat, db_alias):
+        timings = list()
+        n_rows = -1
+        for idx in range(repeat):
+            t_start = time.monotonic()
+            try:
+                # a savepoint keeps the outer transaction usable on failures
+                with transaction.atomic(using=db_alias):
+                    n_rows = query()
+            except Exception as exc:
+                LOG.error("Benchmark %s failed" % label, exc_info=True)
+                self.stdout.write("%-8s failed: %s" % (label, str(exc)))
+                return
+            timings.append(time.monotonic() - t_start)
+
+        self.stdout.write("%-8s orphans: %d  best: %.3f s  mean: %.3f s" % 
+                          (label, n_rows, min(timings), sum(timings) / len(timings)))
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        db_alias = router.db_for_write(Registration)
+
+        try:
+            with transaction.atomic(using=db_alias):
+                t_start = time.monotonic()
+                self.populate(options['n_regs'], options['batch_size'])
+                self.stdout.write("Synthetic data: %d registrations in %.3f s" %
+                                  (options['n_regs'], time.monotonic() - t_start))
+                self.stdout.write("Total registrations: %d" % Registration.objects.count())
+
+                self.run_bench('legacy', self.legacy_query, options['repeat'], db_alias)
+                self.run_bench('exists', self.exists_query, options['repeat'], db_alias)
+
+                transaction.set_rollback(True, using=db_alias)
+        except:
+            LOG.error("Benchmark failed", exc_info=True)
+            raise CommandError("Benchmark failed")
+
@@ -14,18 +14,24 @@
 #  under the License. 
 
 import logging
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 from django.db import transaction
+from django.db.models import Max
+from django.db.models import Q
 from django.core.management.base import CommandError
 from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import Expiration
 from openstack_auth_shib.models import PrjRequest
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import PrjRole
+from openstack_auth_shib.models import LogBuffer
 
 from openstack_auth_shib.notifications import notifyUser
+from openstack_auth_shib.notifications import NotificationBatch
 from openstack_auth_shib.notifications import notifyAdmin
 from openstack_auth_shib.notifications import USER_EXPIRED_TYPE
 from openstack_auth_shib.notifications import DEL_USERS_SUMMARY
@@ -33,12 +39,28 @@ from openstack_auth_shib.notifications import DEL_USERS_SUMMARY
 from horizon.management.commands.cronscript_utils import CloudVenetoCommand
 from horizon.management.commands.cronscript_utils import get_prjman_roleid
 
-from keystoneclient.v3 import client
-
 LOG = logging.getLogger("checkexpiration")
 
 class Command(CloudVenetoCommand):
 
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--bulk',
+                            dest='bulk',
+                            action='store_true',
+                            default=False,
+                            help='Process all the expired memberships with set-based queries')
+        parser.add_argument('--chunk-size',
+                            dest='chunksize',
+                            type=int,
+                            default=500,
+                            help='Number of memberships removed in a single transaction (bulk mode)')
+        parser.add_argument('--workers',
+                            dest='workers',
+                            type=int,
+                            default=8,
+                            help='Number of parallel keystone revocations (bulk mode)')
+
     def handle(self, *args, **options):
     
         super(Command, self).handle(options)
@@ -46,16 +68,10 @@ class Command(CloudVenetoCommand):
         LOG.info("Checking expired users")
         try:
 
-            keystone_client = client.Client(username=self.config.cron_user,
-                                            password=self.config.cron_pwd,
-                                            project_name=self.config.cron_prj,
-                                            user_domain_name=self.config.cron_domain,
-                                            project_domain_name=self.config.cron_domain,
-                                            cacert=self.config.cron_ca,
-                                            auth_url=self.config.cron_kurl)
+            keystone_client = self.get_keystone_client()
 
             prjman_roleid = get_prjman_roleid(keystone_client)
-            cloud_adminid = keystone_client.auth_ref.user_id
+            cloud_adminid = self.get_keystone_session().get_user_id()
 
         except:
             LOG.error("Check expiration failed", exc_info=True)
@@ -63,6 +79,24 @@ class Command(CloudVenetoCommand):
 
         exp_date = datetime.now(timezone.utc) - timedelta(self.config.cron_defer)
 
+        with NotificationBatch(), LogBuffer():
+
+            if options.get('bulk', False):
+                summary_list = self.bulk_check(keystone_client, prjman_roleid, cloud_adminid,
+                                               exp_date, options['chunksize'], options['workers'])
+            else:
+                summary_list = self.serial_check(keystone_client, prjman_roleid, cloud_adminid,
+                                                 exp_date)
+
+            if len(summary_list) > 0:
+                try:
+                    noti_params = { 'summary' : summary_list }
+                    notifyAdmin(DEL_USERS_SUMMARY, noti_params)
+                except:
+                    LOG.error("Cannot send summary", exc_info=True)
+
+    def serial_check(self, keystone_client, prjman_roleid, cloud_adminid, exp_date):
+
         summary_list = list()
 
         for mem_item in Expiration.objects.filter(expdate__lt=exp_date):
@@ -116,10 +150,137 @@ class Command(CloudVenetoCommand):
             except:
                 LOG.error("Cannot send notification for expired user %s" % username, exc_info=True)
 
-        if len(summary_list) > 0:
+        return summary_list
+
+    #
+    # Bulk mode: the database is updated first, with chunked transactions,
+    # then the keystone role assignments are revoked by a pool of workers.
+    # Unlike the serial mode a keystone failure does not restore the membership
+    # in the database, the failure is just reported in the log.
+    #
+    def bulk_check(self, keystone_client, prjman_roleid, cloud_adminid, exp_date,
+                   chunk_size, n_workers):
+
+        t_start = time.monotonic()
+
+        exp_list = list(Expiration.objects.filter(expdate__lt=exp_date)
+                                          .select_related('registration', 'project'))
+        if len(exp_list) == 0:
+            return list()
+
+        reg_table = dict()
+        for exp_item in exp_list:
+            reg_table[exp_item.registration.regid] = exp_item.registration
+
+        mail_table = dict()
+        for regid, email in EMail.objects.filter(registration__in = reg_table.keys()) \
+                                         .order_by('-id').values_list('registration', 'email'):
+            mail_table[regid] = email
+
+        t_plan = time.monotonic()
+        LOG.info("Planned %d expirations in %.3f s" % (len(exp_list), t_plan - t_start))
+
+        removed = list()
+        adm_candidates = set()
+
+        for idx in range(0, len(exp_list), chunk_size):
+            chunk = exp_list[idx:idx + chunk_size]
+            pair_filter = Q()
+            for exp_item in chunk:
+                pair_filter |= Q(registration = exp_item.registration_id,
+                                 project = exp_item.project_id)
             try:
-                noti_params = { 'summary' : summary_list }
-                notifyAdmin(DEL_USERS_SUMMARY, noti_params)
+                with transaction.atomic():
+                    Expiration.objects.filter(id__in = [ x.id for x in chunk ]).delete()
+                    PrjRequest.objects.filter(pair_filter).delete()
+
+                    role_qset = PrjRole.objects.filter(pair_filter)
+                    adm_pairs = set(role_qset.values_list('registration', 'project'))
+                    role_qset.delete()
+
+                removed.extend(chunk)
+                for exp_item in chunk:
+                    if (exp_item.registration_id, exp_item.project_id) in adm_pairs:
+                        adm_candidates.add((exp_item.registration_id, exp_item.project_id))
             except:
-                LOG.error("Cannot send summary", exc_info=True)
+                LOG.error("Check expiration failed for chunk %d" % (idx // chunk_size),
+                          exc_info=True)
+
+        #
+        # Registration.expdate is the max expiration date of the user
+        #
+        with transaction.atomic():
+            exp_table = dict(Expiration.objects.filter(registration__in = reg_table.keys())
+                                               .values('registration')
+                                               .annotate(max_exp = Max('expdate'))
+                                               .values_list('registration', 'max_exp'))
+            now = datetime.now(timezone.utc)
+            for regid, reg_item in reg_table.items():
+                reg_item.expdate = exp_table.get(regid, now)
+            Registration.objects.bulk_update(reg_table.values(), [ 'expdate' ],
+                                             batch_size = chunk_size)
+
+        adm_projects = set(x[1] for x in adm_candidates)
+        still_managed = set(PrjRole.objects.filter(project__in = adm_projects)
+                                           .values_list('project', flat = True)
+                                           .distinct())
+        orphan_projects = adm_projects - still_managed
+
+        t_db = time.monotonic()
+        LOG.info("Removed %d memberships from database in %.3f s" % (len(removed), t_db - t_plan))
+
+        def revoke_roles(exp_item):
+            arg_dict = {
+                'project' : exp_item.project.projectid,
+                'user' : exp_item.registration.userid
+            }
+            try:
+                for r_item in keystone_client.role_assignments.list(**arg_dict):
+                    keystone_client.roles.revoke(r_item.role['id'], **arg_dict)
+                LOG.info("Removed %s from %s" % (exp_item.registration.username,
+                                                 exp_item.project.projectid))
+                return True
+            except:
+                LOG.error("Cannot revoke roles for %s" % exp_item.registration.username,
+                          exc_info=True)
+                return False
+
+        with ThreadPoolExecutor(max_workers = max(n_workers, 1)) as executor:
+            revoked = list(executor.map(revoke_roles, removed))
+
+        for exp_item in removed:
+            if exp_item.project_id in orphan_projects:
+                prjid = exp_item.project.projectid
+                try:
+                    keystone_client.roles.grant(prjman_roleid, user=cloud_adminid, project=prjid)
+                    LOG.info("Cloud Administrator as admin for %s" % prjid)
+                except:
+                    LOG.error("Cannot set super admin for project %s" % prjid, exc_info=True)
+                orphan_projects.discard(exp_item.project_id)
+
+        t_ks = time.monotonic()
+        LOG.info("Revoked %d memberships in keystone (%d failures) in %.3f s" % \
+                 (len(removed), revoked.count(False), t_ks - t_db))
+
+        summary_list = list()
+        for exp_item in removed:
+            username = exp_item.registration.username
+            userid = exp_item.registration.userid
+            prjname = exp_item.project.projectname
+            user_mail = mail_table.get(exp_item.registration_id, None)
+            is_last_admin = (exp_item.registration_id, exp_item.project_id) in adm_candidates \
+                            and exp_item.project_id not in still_managed
+
+            summary_list.append((username, user_mail, prjname, is_last_admin))
+
+            try:
+                noti_params = { 'username' : username, 'project' : prjname }
+                notifyUser(user_mail, USER_EXPIRED_TYPE, noti_params,
+                           project_id=exp_item.project.projectid, dst_user_id=userid)
+            except:
+                LOG.error("Cannot send notification for expired user %s" % username, exc_info=True)
+
+        LOG.info("Notified %d users in %.3f s" % (len(removed), time.monotonic() - t_ks))
+
+        return summary_list
 
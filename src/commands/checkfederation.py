@@ -0,0 +1,60 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import logging
+
+from django.core.management.base import CommandError
+
+from openstack_auth_shib.idpmanager import checkFederationSetup
+from openstack_auth_shib.idpmanager import FEDERATION_RECONCILED
+from openstack_auth_shib.idpmanager import FEDERATION_VERIFIED
+from openstack_auth_shib.idpmanager import FEDERATION_BUSY
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("checkfederation")
+
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--force',
+                            dest='force',
+                            action='store_true',
+                            default=False,
+                            help='Ignore the marker of the last successful check')
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        try:
+            kclient = self.get_keystone_client()
+        except:
+            LOG.error("Cannot connect to keystone", exc_info=True)
+            raise CommandError("Cannot connect to keystone")
+
+        result = checkFederationSetup(kclient=kclient, force=options['force'])
+
+        if result == FEDERATION_RECONCILED:
+            LOG.info("Federation setup reconciled")
+        elif result == FEDERATION_VERIFIED:
+            LOG.info("Federation setup already verified, skipped")
+        elif result == FEDERATION_BUSY:
+            LOG.info("Federation setup check running in another process, skipped")
+        else:
+            LOG.error("Cannot reconcile the federation setup")
+            raise CommandError("Cannot reconcile the federation setup")
+
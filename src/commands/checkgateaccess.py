@@ -14,21 +14,23 @@
 #  under the License. 
 
 import logging
+import os
+import shutil
 import subprocess
+import tempfile
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 from django.db import transaction
 from django.core.management.base import CommandError
 
-from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import RegRequest
-from openstack_auth_shib.models import PrjRequest
 from openstack_auth_shib.models import EMail
-from openstack_auth_shib.models import Expiration
 from openstack_auth_shib.models import RSTATUS_DISABLING
 from openstack_auth_shib.models import RSTATUS_DISABLED
 from openstack_auth_shib.models import RSTATUS_REENABLING
-from openstack_auth_shib.models import PSTATUS_RENEW_DISC
+from openstack_auth_shib.models import orphan_registrations
 
 from horizon.management.commands.cronscript_utils import CloudVenetoCommand
 
@@ -36,94 +38,224 @@ LOG = logging.getLogger("checkgateaccess")
 
 class Command(CloudVenetoCommand):
 
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--batch',
+                            dest='batch',
+                            action='store_true',
+                            default=False,
+                            help='Run the remote calls in parallel on a single SSH connection')
+        parser.add_argument('--workers',
+                            dest='workers',
+                            type=int,
+                            default=4,
+                            help='Number of parallel remote calls (batch mode)')
+        parser.add_argument('--stdin',
+                            dest='use_stdin',
+                            action='store_true',
+                            default=False,
+                            help='Pass the emails to the remote script through stdin (batch mode)')
+        parser.add_argument('--chunk-size',
+                            dest='chunksize',
+                            type=int,
+                            default=100,
+                            help='Number of emails for each remote call (stdin mode)')
+        parser.add_argument('--dry-run',
+                            dest='dry_run',
+                            action='store_true',
+                            default=False,
+                            help='Log the remote calls without running them (as GATE_DRY_RUN)')
+
     def schedule_ban(self):
         try:
             with transaction.atomic():
 
-                qset1 = RegRequest.objects.all()
-                pend_orphans = set(qset1.values_list('registration', flat = True).distinct())
-
-                qset2 = Expiration.objects.all()
-                act_users = set(qset2.values_list('registration', flat = True).distinct())
-
-                qset3 = PrjRequest.objects.exclude(flowstatus = PSTATUS_RENEW_DISC)
-                pend_prjusr = set(qset3.values_list('registration', flat = True).distinct())
-
-                new_orphans = Registration.objects.exclude(regid__in = pend_orphans | act_users | pend_prjusr)
-                for item in new_orphans:
-                    q_args = {
-                        'registration' : item,
-                        'email' : "-",
-                        'flowstatus' : RSTATUS_DISABLING,
-                        'notes' : "-"
-                    }
-                    RegRequest(**q_args).save()
-                    LOG.info("Scheduled ban for %s" % item.username)
+                new_orphans = orphan_registrations(with_regrequests = True)
+                new_orphans = list(new_orphans.values_list('regid', 'username'))
+
+                RegRequest.objects.bulk_create([
+                    RegRequest(
+                        registration_id = regid,
+                        email = "-",
+                        flowstatus = RSTATUS_DISABLING,
+                        notes = "-"
+                    ) for regid, username in new_orphans
+                ])
+
+            for regid, username in new_orphans:
+                LOG.info("Scheduled ban for %s" % username)
         except:
             LOG.error("Orphan schedule failed", exc_info=True)
             raise CommandError("Orphan schedule failed")
 
+    def get_target_emails(self, flowstatus):
+        # the selection runs in a short transaction and takes no row lock,
+        # ban_user and allow_user re-check the flowstatus when they update
+        with transaction.atomic():
+            reg_set = RegRequest.objects.filter(flowstatus = flowstatus).values('registration')
+            e_set = EMail.objects.filter(registration__in = reg_set)
+            return list(e_set.values_list('registration_id', 'registration__username', 'email'))
+
+    def ssh_args(self, *args):
+        result = [
+            '/usr/bin/ssh', '-i', self.config.key_path,
+            '-oStrictHostKeyChecking=no',
+            '-oUserKnownHostsFile=/tmp/horizon_known_hosts'
+        ]
+        if self.control_path:
+            result.append('-oControlPath=%s' % self.control_path)
+        result.extend(args)
+        result.append("%s@%s" % (self.config.gate_user, self.config.gate_address))
+        return result
+
+    #
+    # Batch mode: all the remote calls are multiplexed on a single
+    # SSH ControlMaster connection, opened before the remote phase
+    #
+    def open_master(self):
+        self.control_dir = tempfile.mkdtemp(prefix='cgate')
+        self.control_path = os.path.join(self.control_dir, 'cm')
+        cmd_args = self.ssh_args('-oControlMaster=yes', '-oControlPersist=yes', '-N', '-f')
+        if subprocess.run(cmd_args).returncode != 0:
+            LOG.error("Cannot open the master connection to the gate")
+            self.close_master()
+            return False
+        return True
+
+    def close_master(self):
+        if os.path.exists(self.control_path):
+            subprocess.run(self.ssh_args('-O', 'exit'),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_path = None
+        self.control_dir = None
+
     def run_remote_script(self, remote_script, u_email):
 
-        if self.config.gate_dry_run:
+        if self.dry_run:
             LOG.info("Remote call to %s for %s" % (remote_script, u_email))
             return True
 
         try:
-            cmd_args = [
-                '/usr/bin/ssh', '-i', self.config.key_path,
-                '-oStrictHostKeyChecking=no',
-                '-oUserKnownHostsFile=/tmp/horizon_known_hosts',
-                "%s@%s" % (self.config.gate_user, self.config.gate_address),
-                'sudo', remote_script, u_email
-            ]
+            cmd_args = self.ssh_args() + [ 'sudo', remote_script, u_email ]
             ssh_proc = subprocess.run(cmd_args)
         except:
-            LOG.error("Cannot change user %s on gate" % orphan.registration.username, exc_info=True)
+            LOG.error("Cannot change user %s on gate" % u_email, exc_info=True)
+            return False
+
+        return ssh_proc.returncode == 0
+
+    #
+    # The remote script is called with "-" as argument and reads
+    # the emails from stdin, one per line
+    #
+    def run_remote_stdin(self, remote_script, e_list):
+
+        if self.dry_run:
+            LOG.info("Remote call to %s for %s" % (remote_script, ", ".join(e_list)))
+            return True
+
+        try:
+            cmd_args = self.ssh_args() + [ 'sudo', remote_script, '-' ]
+            ssh_proc = subprocess.run(cmd_args, input="\n".join(e_list) + "\n",
+                                      universal_newlines=True)
+        except:
+            LOG.error("Cannot change users %s on gate" % ", ".join(e_list), exc_info=True)
             return False
 
         return ssh_proc.returncode == 0
 
+    def run_remote_chunk(self, remote_script, chunk):
+        if self.run_remote_stdin(remote_script, [ x[2] for x in chunk ]):
+            return chunk
+        # find out the failed emails calling the script one by one
+        LOG.warning("Remote call failed for %d users, retrying one by one" % len(chunk))
+        return [ x for x in chunk if self.run_remote_script(remote_script, x[2]) ]
+
+    def run_remote_phase(self, remote_script, targets):
+        t_start = time.monotonic()
+
+        if not self.batch:
+            result = [ x for x in targets if self.run_remote_script(remote_script, x[2]) ]
+
+        elif self.use_stdin:
+            c_size = max(self.chunk_size, 1)
+            chunks = [ targets[k:k + c_size] for k in range(0, len(targets), c_size) ]
+            with ThreadPoolExecutor(max_workers = max(self.workers, 1)) as executor:
+                results = executor.map(lambda c: self.run_remote_chunk(remote_script, c), chunks)
+                result = [ x for c_res in results for x in c_res ]
+
+        else:
+            with ThreadPoolExecutor(max_workers = max(self.workers, 1)) as executor:
+                results = executor.map(lambda t: self.run_remote_script(remote_script, t[2]), targets)
+                result = [ t for t, res in zip(targets, results) if res ]
+
+        LOG.info("Remote phase %s: %d/%d users in %.3f s" %
+                 (remote_script, len(result), len(targets), time.monotonic() - t_start))
+        return result
+
     def ban_user(self):
-        disabled_users = list()
-        with transaction.atomic():
-            qset3 = RegRequest.objects.filter(flowstatus = RSTATUS_DISABLING)
-            for orphan in EMail.objects.filter(registration__in = [ x.registration for x in qset3 ]):
-                if self.run_remote_script(self.config.ban_script, orphan.email):
-                    disabled_users.append(orphan.registration)
+        targets = self.get_target_emails(RSTATUS_DISABLING)
+        disabled_users = self.run_remote_phase(self.config.ban_script, targets)
 
-            qset4 = RegRequest.objects.filter(registration__in = disabled_users)
-            qset4.update(flowstatus = RSTATUS_DISABLED)
+        q_args = {
+            'registration__in' : [ x[0] for x in disabled_users ],
+            'flowstatus' : RSTATUS_DISABLING
+        }
+        RegRequest.objects.filter(**q_args).update(flowstatus = RSTATUS_DISABLED)
 
-        for orphan in disabled_users:
-            LOG.info("Disabled user %s" % orphan.username)
+        for regid, username, email in disabled_users:
+            LOG.info("Disabled user %s" % username)
 
     def allow_user(self):
-        enabled_users = list()
-        with transaction.atomic():
-            qset5 = RegRequest.objects.filter(flowstatus = RSTATUS_REENABLING)
-            for orphan in EMail.objects.filter(registration__in = [ x.registration for x in qset5 ]):
-                if self.run_remote_script(self.config.allow_script, orphan.email):
-                    enabled_users.append(orphan.registration)
+        targets = self.get_target_emails(RSTATUS_REENABLING)
+        enabled_users = self.run_remote_phase(self.config.allow_script, targets)
 
-            RegRequest.objects.filter(registration__in = enabled_users).delete()
+        q_args = {
+            'registration__in' : [ x[0] for x in enabled_users ],
+            'flowstatus' : RSTATUS_REENABLING
+        }
+        RegRequest.objects.filter(**q_args).delete()
 
-        for orphan in enabled_users:
-            LOG.info("Enabled user %s" % orphan.username)
+        for regid, username, email in enabled_users:
+            LOG.info("Enabled user %s" % username)
 
     def handle(self, *args, **options):
     
         super(Command, self).handle(options)
-        if not self.config.gate_dry_run and (not self.config.key_path or not self.config.gate_address):
+
+        self.dry_run = options['dry_run'] or self.config.gate_dry_run
+        self.batch = options['batch']
+        self.use_stdin = options['use_stdin']
+        self.workers = options['workers']
+        self.chunk_size = options['chunksize']
+        self.control_path = None
+        self.control_dir = None
+
+        if not self.dry_run and (not self.config.key_path or not self.config.gate_address):
             return
 
+        t_start = time.monotonic()
         self.schedule_ban()
+        LOG.info("Ban schedule in %.3f s" % (time.monotonic() - t_start))
+
+        if not self.config.ban_script and not self.config.allow_script:
+            return
+
+        if self.batch and not self.dry_run and not self.open_master():
+            raise CommandError("Cannot connect to the gate")
+
+        try:
+            if self.config.ban_script:
+                time.sleep(1)
+                self.ban_user()
 
-        if self.config.ban_script:
-            time.sleep(1)
-            self.ban_user()
+            if self.config.allow_script:
+                time.sleep(1)
+                self.allow_user()
+        finally:
+            if self.control_path:
+                self.close_master()
 
-        if self.config.allow_script:
-            time.sleep(1)
-            self.allow_user()
+        LOG.info("Gate access checked in %.3f s" % (time.monotonic() - t_start))
 
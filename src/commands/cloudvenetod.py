@@ -0,0 +1,229 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import json
+import logging
+import os
+import shlex
+import signal
+import time
+
+from datetime import datetime, timedelta
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import close_old_connections
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("cloudvenetod")
+
+#
+# Crontab-like schedule:
+# <minute> <hour> <day of month> <month> <day of week> <command> [<arguments>]
+#
+DEFAULT_SCHEDULE = '/etc/openstack-auth-shib/cloudvenetod.conf'
+DEFAULT_STATUS = '/var/cache/openstack-auth-shib/cloudvenetod.json'
+
+FIELD_RANGES = [ (0, 59), (0, 23), (1, 31), (1, 12), (0, 7) ]
+
+def parse_field(field, min_value, max_value):
+    result = set()
+    for item in field.split(','):
+        step = 1
+        if '/' in item:
+            item, tmps = item.split('/', 1)
+            step = int(tmps)
+        if item == '*':
+            first, last = min_value, max_value
+        elif '-' in item:
+            first, last = [ int(x) for x in item.split('-', 1) ]
+        else:
+            first = last = int(item)
+        if first < min_value or last > max_value or first > last or step < 1:
+            raise ValueError("Bad schedule field %s" % field)
+        result.update(range(first, last + 1, step))
+    return result
+
+class ScheduledJob:
+
+    def __init__(self, sched_line):
+        tokens = shlex.split(sched_line)
+        if len(tokens) < 6:
+            raise ValueError("Bad schedule line: %s" % sched_line)
+
+        self.minutes, self.hours, self.mdays, self.months, self.wdays = [
+            parse_field(tokens[idx], *FIELD_RANGES[idx]) for idx in range(5)
+        ]
+        # both 0 and 7 are Sunday
+        if 7 in self.wdays:
+            self.wdays.add(0)
+        self.mday_any = tokens[2] == '*'
+        self.wday_any = tokens[4] == '*'
+
+        self.name = tokens[5]
+        self.args = tokens[6:]
+
+        self.runs = 0
+        self.failures = 0
+        self.last_start = None
+        self.last_duration = None
+        self.last_status = None
+        self.last_error = None
+
+    def match(self, tstamp):
+        if tstamp.minute not in self.minutes or tstamp.hour not in self.hours:
+            return False
+        if tstamp.month not in self.months:
+            return False
+
+        mday_ok = tstamp.day in self.mdays
+        wday_ok = ((tstamp.weekday() + 1) % 7) in self.wdays
+        # same rule of cron: if both are restricted, either one can match
+        if self.mday_any or self.wday_any:
+            return mday_ok and wday_ok
+        return mday_ok or wday_ok
+
+    def status(self):
+        return {
+            'command' : ' '.join([ self.name ] + self.args),
+            'runs' : self.runs,
+            'failures' : self.failures,
+            'last_start' : self.last_start.isoformat() if self.last_start else None,
+            'last_duration' : self.last_duration,
+            'last_status' : self.last_status,
+            'last_error' : self.last_error
+        }
+
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--schedule',
+                            dest='schedule',
+                            action='store',
+                            default=DEFAULT_SCHEDULE,
+                            help='The crontab-like schedule of the jobs')
+        parser.add_argument('--status-file',
+                            dest='statusfile',
+                            action='store',
+                            default=DEFAULT_STATUS,
+                            help='The file reporting the status of the jobs')
+
+    def load_schedule(self, sched_file):
+        result = list()
+        with open(sched_file) as sfile:
+            for line in sfile:
+                tmps = line.strip()
+                if len(tmps) == 0 or tmps.startswith('#'):
+                    continue
+                result.append(ScheduledJob(tmps))
+        return result
+
+    def run_job(self, job, conffile):
+
+        job.last_start = datetime.now()
+        t_start = time.monotonic()
+        close_old_connections()
+
+        try:
+            job_args = list(job.args)
+            if conffile:
+                job_args += [ '--config', conffile ]
+            call_command(job.name, *job_args)
+            job.last_status = 'ok'
+            job.last_error = None
+        except Exception as exc:
+            LOG.error("Job %s failed" % job.name, exc_info=True)
+            job.failures += 1
+            job.last_status = 'failed'
+            job.last_error = str(exc)
+        finally:
+            close_old_connections()
+
+        job.runs += 1
+        job.last_duration = round(time.monotonic() - t_start, 3)
+        LOG.info("Job %s completed in %.3f s: %s" % (job.name, job.last_duration, job.last_status))
+
+    def write_status(self, jobs, statusfile):
+        if not statusfile:
+            return
+        try:
+            tmpname = statusfile + '.tmp'
+            with open(tmpname, 'w') as sfile:
+                json.dump({
+                    'pid' : os.getpid(),
+                    'updated' : datetime.now().isoformat(),
+                    'jobs' : [ x.status() for x in jobs ]
+                }, sfile, indent=2)
+            os.replace(tmpname, statusfile)
+        except:
+            LOG.error("Cannot write status file", exc_info=True)
+
+    def stop(self, signum, frame):
+        LOG.info("Received signal %d, stopping" % signum)
+        self.running = False
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        try:
+            jobs = self.load_schedule(options['schedule'])
+        except:
+            LOG.error("Cannot load schedule", exc_info=True)
+            raise CommandError("Cannot load schedule")
+
+        conffile = options.get('conffile', None)
+        statusfile = options.get('statusfile', None)
+
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        LOG.info("Started with %d jobs" % len(jobs))
+        self.write_status(jobs, statusfile)
+
+        last_tick = datetime.now().replace(second=0, microsecond=0)
+
+        while self.running:
+
+            now = datetime.now()
+            next_tick = last_tick + timedelta(minutes=1)
+            if now < next_tick:
+                time.sleep(min((next_tick - now).total_seconds(), 1.0))
+                continue
+
+            #
+            # Jobs that missed their slot while others were running are
+            # executed once, as soon as possible
+            #
+            ready_jobs = list()
+            curr_tick = next_tick
+            while curr_tick <= now:
+                for job in jobs:
+                    if job not in ready_jobs and job.match(curr_tick):
+                        ready_jobs.append(job)
+                curr_tick += timedelta(minutes=1)
+            last_tick = curr_tick - timedelta(minutes=1)
+
+            for job in ready_jobs:
+                if not self.running:
+                    break
+                self.run_job(job, conffile)
+                self.write_status(jobs, statusfile)
+
+        LOG.info("Stopped")
+
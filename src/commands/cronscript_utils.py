@@ -13,14 +13,39 @@
 #  License for the specific language governing permissions and limitations
 #  under the License. 
 
+import hashlib
+import json
 import logging
 import logging.config
+import os
+import stat
+import threading
+
+from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from keystoneauth1 import session as ks_session
+from keystoneauth1.identity import v3 as ks_identity
+from keystoneclient.v3 import client
+
 LOG = logging.getLogger("cronscript_utils")
 
+#
+# Keystone sessions are shared by all the commands running in the same
+# process (see cloudvenetod), the key is the set of credentials.
+# The scoped token is persisted in a root-only cache file and it is reused
+# by the next commands until TOKEN_MARGIN seconds before the expiration.
+#
+SESSION_TABLE = dict()
+SESSION_LOCK = threading.Lock()
+
+TOKEN_MARGIN = 300
+
 class CloudVenetoCommand(BaseCommand):
 
     def add_arguments(self, parser):
@@ -57,6 +82,13 @@ class CloudVenetoCommand(BaseCommand):
                 self.config.cron_renewd = int(params.get('RENEW_DAYS', '30'))
                 self.config.cron_defer = int(params.get('DEFER_DAYS', '0'))
                 self.config.cron_plan = params.get('NOTIFICATION_PLAN', None)
+                self.config.token_cache = params.get('TOKEN_CACHE', self.config.token_cache)
+
+    def get_keystone_session(self):
+        return get_keystone_session(self.config)
+
+    def get_keystone_client(self):
+        return client.Client(session=self.get_keystone_session())
 
     def _readParameters(self, conffile):
         result = dict()
@@ -77,6 +109,91 @@ class CloudVenetoCommand(BaseCommand):
         return result
 
 
+def _session_key(config):
+    tmps = '|'.join([ config.cron_kurl, config.cron_user, config.cron_pwd,
+                      config.cron_prj, config.cron_domain, config.cron_ca ])
+    return hashlib.sha256(tmps.encode('utf-8')).hexdigest()
+
+def _read_token_cache(cache_file, s_key):
+    try:
+        f_stat = os.stat(cache_file)
+        if f_stat.st_uid != os.getuid() or f_stat.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            LOG.warning("Ignored token cache %s: bad owner or permissions" % cache_file)
+            return None
+
+        with open(cache_file) as cfile:
+            c_data = json.load(cfile)
+        if c_data.get('key', None) != s_key:
+            return None
+
+        exp_date = datetime.fromisoformat(c_data['expires'])
+        if exp_date - timedelta(seconds=TOKEN_MARGIN) < datetime.now(timezone.utc):
+            return None
+        return c_data['state']
+    except FileNotFoundError:
+        pass
+    except:
+        LOG.error("Cannot read token cache", exc_info=True)
+    return None
+
+def _write_token_cache(cache_file, s_key, auth):
+    try:
+        a_ref = auth.auth_ref
+        if not a_ref or not a_ref.expires:
+            return
+        c_data = {
+            'key' : s_key,
+            'expires' : a_ref.expires.isoformat(),
+            'state' : auth.get_auth_state()
+        }
+        fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as cfile:
+            json.dump(c_data, cfile)
+    except:
+        LOG.error("Cannot write token cache", exc_info=True)
+
+def get_keystone_session(config):
+    s_key = _session_key(config)
+
+    with SESSION_LOCK:
+        if s_key in SESSION_TABLE:
+            return SESSION_TABLE[s_key]
+
+        auth = ks_identity.Password(auth_url=config.cron_kurl,
+                                    username=config.cron_user,
+                                    password=config.cron_pwd,
+                                    project_name=config.cron_prj,
+                                    user_domain_name=config.cron_domain,
+                                    project_domain_name=config.cron_domain)
+
+        cached_state = None
+        if config.token_cache:
+            cached_state = _read_token_cache(config.token_cache, s_key)
+            if cached_state:
+                auth.set_auth_state(cached_state)
+                LOG.debug("Reusing cached token")
+
+        #
+        # Keep-alive connections are pooled for the parallel workers
+        #
+        req_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=config.pool_size,
+                              pool_maxsize=config.pool_size)
+        req_session.mount('https://', adapter)
+        req_session.mount('http://', adapter)
+
+        k_session = ks_session.Session(auth=auth,
+                                       session=req_session,
+                                       verify=config.cron_ca or True)
+
+        if config.token_cache and not cached_state:
+            k_session.get_token()
+            _write_token_cache(config.token_cache, s_key, auth)
+
+        SESSION_TABLE[s_key] = k_session
+        return k_session
+
 def get_prjman_roleid(keystone):
     role_name = getattr(settings, 'TENANTADMIN_ROLE', 'project_manager')
     
@@ -104,6 +221,9 @@ class ConfigBin:
         self.ban_script = script_params.get('GATE_BAN_SCRIPT', None)
         self.allow_script = script_params.get('GATE_ALLOW_SCRIPT', None)
         self.gate_dry_run = script_params.get('GATE_DRY_RUN', False)
+        self.token_cache = script_params.get('TOKEN_CACHE',
+                                             '/var/cache/openstack-auth-shib/cron_token.json')
+        self.pool_size = int(script_params.get('CONNECTION_POOL_SIZE', 10))
 
 def build_contact_list():
     return getattr(settings, 'MANAGERS', None)
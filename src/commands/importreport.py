@@ -0,0 +1,153 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from django.core.management.base import CommandError
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("importreport")
+
+DEFAULT_MODULES = [
+    'openstack_auth_shib.views',
+    'openstack_auth_shib.idpmanager',
+    'openstack_auth_shib.notifications'
+]
+
+#
+# Packages whose presence after the startup imports is highlighted
+#
+WATCH_LIST = [
+    'keystone',
+    'keystoneclient',
+    'novaclient',
+    'cinderclient',
+    'neutronclient'
+]
+
+#
+# The probe runs in a fresh interpreter, the report of -X importtime goes
+# on stderr, the probe summary on stdout as a JSON document
+#
+PROBE_SCRIPT = '''
+import json, resource, sys, time
+t_start = time.monotonic()
+import django
+django.setup()
+for mod_name in sys.argv[1:]:
+    __import__(mod_name)
+print(json.dumps({
+    'elapsed' : time.monotonic() - t_start,
+    'maxrss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules' : sorted(sys.modules.keys())
+}))
+'''
+
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--module',
+                            dest='modules',
+                            action='append',
+                            default=None,
+                            help='Module to be imported (it can be repeated)')
+        parser.add_argument('--top',
+                            dest='top',
+                            action='store',
+                            type=int,
+                            default=20,
+                            help='Number of slowest imports reported')
+        parser.add_argument('--json',
+                            dest='use_json',
+                            action='store_true',
+                            default=False,
+                            help='Print the report as a JSON document')
+
+    def _parse_importtime(self, lines):
+        result = list()
+        for line in lines:
+            if not line.startswith('import time:'):
+                continue
+            fields = line[len('import time:'):].split('|')
+            if len(fields) != 3:
+                continue
+            try:
+                self_us = int(fields[0])
+                cumul_us = int(fields[1])
+            except ValueError:
+                # header line
+                continue
+            mod_name = fields[2].rstrip()
+            level = (len(mod_name) - len(mod_name.lstrip()) - 1) // 2
+            result.append((mod_name.strip(), level, self_us, cumul_us))
+        return result
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        modules = options['modules'] or DEFAULT_MODULES
+
+        try:
+            proc = subprocess.run([ sys.executable, '-X', 'importtime', '-c', PROBE_SCRIPT ] + modules,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  env=os.environ.copy(), universal_newlines=True)
+        except:
+            LOG.error("Cannot run the import probe", exc_info=True)
+            raise CommandError("Cannot run the import probe")
+
+        if proc.returncode != 0:
+            LOG.error("Import probe failed: %s" % proc.stderr.splitlines()[-1:])
+            raise CommandError("Import probe failed")
+
+        probe = json.loads(proc.stdout.strip().splitlines()[-1])
+        entries = self._parse_importtime(proc.stderr.splitlines())
+
+        top_level = [ x for x in entries if x[1] == 0 ]
+        slowest = sorted(entries, key=lambda x: x[3], reverse=True)[:options['top']]
+        loaded = set(probe['modules'])
+
+        report = {
+            'modules' : modules,
+            'elapsed_ms' : round(probe['elapsed'] * 1000, 1),
+            'import_ms' : round(sum(x[3] for x in top_level) / 1000, 1),
+            'maxrss_kb' : probe['maxrss'],
+            'imported' : len(loaded),
+            'watch' : dict((x, x in loaded) for x in WATCH_LIST),
+            'slowest' : [ { 'module' : x[0], 'self_ms' : round(x[2] / 1000, 1),
+                            'cumulative_ms' : round(x[3] / 1000, 1) } for x in slowest ]
+        }
+
+        if options['use_json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write("Modules:          %s" % ", ".join(modules))
+        self.stdout.write("Cold start:       %.1f ms" % report['elapsed_ms'])
+        self.stdout.write("Import time:      %.1f ms" % report['import_ms'])
+        self.stdout.write("Max RSS:          %d KB" % report['maxrss_kb'])
+        self.stdout.write("Loaded modules:   %d" % report['imported'])
+        for pkg_name, pkg_loaded in report['watch'].items():
+            self.stdout.write("  %-16s %s" % (pkg_name, "loaded" if pkg_loaded else "not loaded"))
+        self.stdout.write("%12s %14s  %s" % ("self [ms]", "cumul. [ms]", "module"))
+        for item in report['slowest']:
+            self.stdout.write("%12.1f %14.1f  %s" % (item['self_ms'], item['cumulative_ms'], item['module']))
+
@@ -26,7 +26,9 @@ from openstack_auth_shib.models import Expiration
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import PrjRequest
 from openstack_auth_shib.models import PSTATUS_RENEW_ATTEMPT
+from openstack_auth_shib.models import LogBuffer
 from openstack_auth_shib.notifications import notifyUser
+from openstack_auth_shib.notifications import NotificationBatch
 from openstack_auth_shib.notifications import USER_EXP_TYPE
 
 from horizon.management.commands.cronscript_utils import CloudVenetoCommand
@@ -92,19 +94,21 @@ class Command(CloudVenetoCommand):
                 for email_item in EMail.objects.filter(registration__userid__in=user_set):
                     mail_table[email_item.registration.userid] = email_item.email
 
-            for days_to_exp, noti_list in noti_table.items():
-                for username, userid, prjname, prjid in noti_list:
-                    try:
-                        noti_params = {
-                            'username' : username,
-                            'project' : prjname,
-                            'days' : days_to_exp
-                        }
-                        notifyUser(mail_table[userid], USER_EXP_TYPE, noti_params,
-                                   user_id=userid, project_id=prjid, dst_user_id=userid)
-                    except:
-                        LOG.error("Cannot notify %s" % username, exc_info=True)
+            with NotificationBatch(), LogBuffer():
+                for days_to_exp, noti_list in noti_table.items():
+                    for username, userid, prjname, prjid in noti_list:
+                        try:
+                            noti_params = {
+                                'username' : username,
+                                'project' : prjname,
+                                'days' : days_to_exp
+                            }
+                            notifyUser(mail_table[userid], USER_EXP_TYPE, noti_params,
+                                       user_id=userid, project_id=prjid, dst_user_id=userid)
+                        except:
+                            LOG.error("Cannot notify %s" % username, exc_info=True)
                 
+
         except:
             LOG.error("Notification failed", exc_info=True)
             raise CommandError("Notification failed")
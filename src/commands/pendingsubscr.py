@@ -17,13 +17,16 @@ import logging
 
 from django.db import transaction
 from django.conf import settings
+from django.db.models import OuterRef
+from django.db.models import Subquery
 from django.core.management.base import CommandError
 from openstack_auth_shib.models import PrjRequest
-from openstack_auth_shib.models import RegRequest
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import PrjRole
 from openstack_auth_shib.models import PSTATUS_PENDING
+from openstack_auth_shib.models import LogBuffer
 from openstack_auth_shib.notifications import notifyUser
+from openstack_auth_shib.notifications import NotificationBatch
 from openstack_auth_shib.notifications import SUBSCR_REMINDER
 
 from horizon.management.commands.cronscript_utils import CloudVenetoCommand
@@ -37,42 +40,47 @@ class Command(CloudVenetoCommand):
         super(Command, self).handle(options)
 
         admin_table = dict()
-        mail_table = dict()
         req_table = dict()
 
         try:
             with transaction.atomic():
 
-                for prj_req in PrjRequest.objects.filter(flowstatus=PSTATUS_PENDING):
-                    prjname = prj_req.project.projectname
+                pend_set = PrjRequest.objects.filter(flowstatus=PSTATUS_PENDING)
+                for prjname, username in pend_set.values_list('project_id', 'registration__username'):
                     if prjname not in req_table:
                         req_table[prjname] = list()
-                    req_table[prjname].append(prj_req.registration.username)
-
-                for prjname in req_table.keys():
-                    for p_role in PrjRole.objects.filter(project__projectname=prjname):
-
-                        user_name = p_role.registration.username
-                        user_id = p_role.registration.userid
-                        user_tuple = (user_name, user_id)
-
-                        if user_tuple not in admin_table:
-                            admin_table[user_tuple] = list()
-                        admin_table[user_tuple].append(p_role.project.projectname)
-
-                        if user_name not in mail_table:
-                            tmpres = EMail.objects.filter(registration__username=user_name)
-                            if len(tmpres):
-                                mail_table[user_name] = tmpres[0].email
-
-            for user_tuple in admin_table:
-                for prj_name in admin_table[user_tuple]:
+                    req_table[prjname].append(username)
+
+                first_mail = EMail.objects.filter(registration=OuterRef('registration')).order_by('id')
+                a_set = PrjRole.objects.filter(project__in=pend_set.values('project'))
+                a_set = a_set.annotate(email=Subquery(first_mail.values('email')[:1]))
+                a_fields = ('registration__username', 'registration__userid', 'email', 'project_id')
+
+                for user_name, user_id, email, prjname in a_set.values_list(*a_fields).distinct():
+                    user_tuple = (user_name, user_id, email)
+                    if user_tuple not in admin_table:
+                        admin_table[user_tuple] = list()
+                    admin_table[user_tuple].append(prjname)
+
+            # one reminder for each administrator with all the projects
+            with NotificationBatch(), LogBuffer():
+                for user_tuple, prj_list in admin_table.items():
                     try:
+                        prj_list.sort()
                         noti_params = {
-                            'pendingreqs' : req_table[prj_name],
-                            'project' : prj_name
+                            'projects' : prj_list,
+                            'pending' : [ { 'project' : x, 'pendingreqs' : req_table[x] }
+                                          for x in prj_list ]
                         }
-                        notifyUser(mail_table[user_tuple[0]], SUBSCR_REMINDER, noti_params,
+                        # keys of the old template (one project per reminder),
+                        # for installations with customized templates
+                        noti_params['project'] = ", ".join(prj_list)
+                        if len(prj_list) == 1:
+                            noti_params['pendingreqs'] = req_table[prj_list[0]]
+                        else:
+                            noti_params['pendingreqs'] = [ "%s (%s)" % (u, x) for x in prj_list
+                                                           for u in req_table[x] ]
+                        notifyUser(user_tuple[2], SUBSCR_REMINDER, noti_params,
                                    dst_user_id=user_tuple[1])
                     except:
                         LOG.error("Cannot notify pending subscription: %s" % user_tuple[0], 
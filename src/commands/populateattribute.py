@@ -16,11 +16,13 @@
 import logging
 
 from django.db import transaction
+from django.db.models import Exists
 from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Subquery
 from django.core.management.base import CommandError
 from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import Project
-from openstack_auth_shib.models import Expiration
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import PrjRole
 from openstack_auth_shib.models import PrjAttribute
@@ -36,6 +38,14 @@ LOG = logging.getLogger("populateattribute")
 
 class Command(CloudVenetoCommand):
 
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--dry-run',
+                            dest='dry_run',
+                            action='store_true',
+                            default=False,
+                            help='Print the attributes to be inserted without changing the database')
+
     def handle(self, *args, **options):
 
         super(Command, self).handle(options)
@@ -44,21 +54,33 @@ class Command(CloudVenetoCommand):
             LOG.info("Populating the attribute table")
 
             with transaction.atomic():
-                for project in Project.objects.filter(projectid__isnull = False):
-                    cnt = 0
-                    admins = [ x.registration for x in PrjRole.objects.filter(project = project) ]
-                    if len(admins) == 0:
-                        continue
-                    p_exp = Expiration.objects.filter(registration__in = admins).aggregate(Max('expdate'))
-                    if not p_exp:
-                        continue
-                    if PrjAttribute.objects.filter(project = project, name = ATT_PRJ_EXP).count() == 0:
-                        PrjAttribute(project = project, name = ATT_PRJ_EXP,
-                                     value = p_exp['expdate__max'].isoformat()).save()
-                        cnt += 1
-                    LOG.info("Update %d expiration date for %s" % (cnt, project.projectname))
+
+                # max expiration of the administrators for each project
+                adm_exp = PrjRole.objects.filter(project = OuterRef('pk')).order_by().values('project')
+                adm_exp = adm_exp.annotate(max_exp = Max('registration__expiration__expdate'))
+
+                q_set = Project.objects.filter(projectid__isnull = False).annotate(
+                    adm_exp = Subquery(adm_exp.values('max_exp')),
+                    has_exp = Exists(PrjAttribute.objects.filter(project = OuterRef('pk'),
+                                                                 name = ATT_PRJ_EXP))
+                ).filter(has_exp = False, adm_exp__isnull = False)
+
+                new_attrs = list()
+                for prjname, adm_exp in q_set.values_list('projectname', 'adm_exp'):
+                    new_attrs.append(PrjAttribute(project_id = prjname, name = ATT_PRJ_EXP,
+                                                  value = adm_exp.isoformat()))
+
+                if options['dry_run']:
+                    for p_attr in new_attrs:
+                        self.stdout.write("+ %s: %s" % (p_attr.project_id, p_attr.value))
+                    self.stdout.write("%d expiration dates to be inserted" % len(new_attrs))
+                    return
+
+                PrjAttribute.objects.bulk_create(new_attrs)
+
+            for p_attr in new_attrs:
+                LOG.info("Update expiration date for %s" % p_attr.project_id)
 
         except:
             LOG.error("Import failed", exc_info=True)
             raise CommandError("Import failed")
-
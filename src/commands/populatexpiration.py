@@ -26,88 +26,113 @@ from openstack_auth_shib.models import PrjRole
 from horizon.management.commands.cronscript_utils import CloudVenetoCommand
 from horizon.management.commands.cronscript_utils import get_prjman_roleid
 
-from keystoneclient.v3 import client
-
 LOG = logging.getLogger("populatexpiration")
 
 class Command(CloudVenetoCommand):
 
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--chunk-size',
+                            dest='chunksize',
+                            type=int,
+                            default=1000,
+                            help='Number of rows for each insert')
+
     def handle(self, *args, **options):
 
         super(Command, self).handle(options)
 
-        try:
+        chunk_size = max(options['chunksize'], 1)
 
-            prj_dict = dict()
-            
-            for prj_item in Project.objects.all():
-                if prj_item.projectid:
-                    prj_dict[prj_item.projectid] = prj_item
+        try:
 
             #
             # TODO define the user_domain_name and project_domain_name
             #
-            keystone_client = client.Client(username=self.config.cron_user,
-                                            password=self.config.cron_pwd,
-                                            project_name=self.config.cron_prj,
-                                            cacert=self.config.cron_ca,
-                                            user_domain_name=self.config.cron_domain,
-                                            project_domain_name=self.config.cron_domain,
-                                            auth_url=self.config.cron_kurl)
+            keystone_client = self.get_keystone_client()
+
+            #
+            # Snapshot of keystone: one listing for the users and one
+            # for the role assignments, the joins are done in memory
+            #
+            LOG.info("Reading users and role assignments from keystone")
+
+            ks_emails = dict()
+            for ks_user in keystone_client.users.list():
+                ks_emails[ks_user.id] = getattr(ks_user, 'email', None)
+
+            ks_assignments = list()
+            for r_item in keystone_client.role_assignments.list():
+                if not hasattr(r_item, 'user') or not 'project' in r_item.scope:
+                    continue
+                ks_assignments.append((r_item.user['id'],
+                                       r_item.scope['project']['id'],
+                                       r_item.role['id']))
+
+            LOG.info("Found %d users and %d project assignments" %
+                     (len(ks_emails), len(ks_assignments)))
+
+            prj_dict = dict(Project.objects.filter(projectid__isnull=False)
+                                           .values_list('projectid', 'projectname'))
+
+            reg_dict = dict()
+            for regid, userid, username, expdate in Registration.objects.values_list(
+                                        'regid', 'userid', 'username', 'expdate'):
+                if not userid:
+                    LOG.info("Skipped unregistered user %s" % username)
+                    continue
+                reg_dict[userid] = (regid, username, expdate)
 
             LOG.info("Populating the expiration table")
 
             with transaction.atomic():
-                for reg_user in Registration.objects.all():
-                
-                    if not reg_user.userid:
-                        LOG.info("Skipped unregistered user %s" % reg_user.username)
-                        continue
-                    
-                    for r_item in keystone_client.role_assignments.list(user=reg_user.userid):
-                        if not r_item.scope['project']['id'] in prj_dict:
-                            LOG.info("Skipped unregistered project %s for %s" % \
-                            (r_item.scope['project']['id'], reg_user.username))
-                        curr_prj = prj_dict[r_item.scope['project']['id']]
-                        
-                        if Expiration.objects.filter(
-                            registration=reg_user,
-                            project=curr_prj
-                        ).count() > 0:
-                            continue
-
-                        prj_exp = Expiration()
-                        prj_exp.registration = reg_user
-                        prj_exp.project = curr_prj
-                        prj_exp.expdate = reg_user.expdate
-                        prj_exp.save()
-                        
-                        LOG.info("Imported expiration for %s in %s: %s" % \
-                        (reg_user.username, curr_prj.projectname, \
-                        reg_user.expdate.strftime("%A, %d. %B %Y %I:%M%p")))
 
-            LOG.info("Populating the email table")
+                exp_keys = set(Expiration.objects.values_list('registration_id', 'project_id'))
+                new_exps = list()
 
-            with transaction.atomic():
-                for reg_user in Registration.objects.all():
+                for userid, prjid, roleid in ks_assignments:
+                    if not userid in reg_dict:
+                        continue
+                    regid, username, expdate = reg_dict[userid]
 
-                    if not reg_user.userid:
-                        LOG.info("Skipped unregistered user %s" % reg_user.username)
+                    if not prjid in prj_dict:
+                        LOG.info("Skipped unregistered project %s for %s" % (prjid, username))
                         continue
+                    prjname = prj_dict[prjid]
 
-                    tmpres = keystone_client.users.get(reg_user.userid)
-                    if not tmpres:
+                    if (regid, prjname) in exp_keys:
                         continue
+                    exp_keys.add((regid, prjname))
 
-                    if EMail.objects.filter(registration=reg_user).count() > 0:
+                    if not expdate:
+                        LOG.info("Skipped expiration for %s in %s: missing date" % (username, prjname))
                         continue
 
-                    mail_obj = EMail()
-                    mail_obj.registration = reg_user
-                    mail_obj.email = tmpres.email
-                    mail_obj.save()
+                    new_exps.append(Expiration(registration_id = regid,
+                                               project_id = prjname,
+                                               expdate = expdate))
+
+                    LOG.info("Imported expiration for %s in %s: %s" % \
+                    (username, prjname, expdate.strftime("%A, %d. %B %Y %I:%M%p")))
 
-                    LOG.info("Imported email for %s: %s" % (reg_user.username, tmpres.email))
+                Expiration.objects.bulk_create(new_exps, batch_size = chunk_size)
+
+            LOG.info("Populating the email table")
+
+            with transaction.atomic():
+
+                mail_regs = set(EMail.objects.values_list('registration_id', flat = True))
+                new_mails = list()
+
+                for userid, reg_data in reg_dict.items():
+                    regid, username, expdate = reg_data
+                    if regid in mail_regs or not ks_emails.get(userid, None):
+                        continue
+
+                    new_mails.append(EMail(registration_id = regid, email = ks_emails[userid]))
+                    LOG.info("Imported email for %s: %s" % (username, ks_emails[userid]))
+
+                EMail.objects.bulk_create(new_mails, batch_size = chunk_size)
 
             LOG.info("Populating the project roles table")
 
@@ -117,29 +142,28 @@ class Command(CloudVenetoCommand):
 
                 PrjRole.objects.all().delete()
 
-                prj_dict = dict()
-                for prj_obj in Project.objects.all():
-                    prj_dict[prj_obj.projectid] = prj_obj
+                role_keys = set()
+                new_roles = list()
 
-                for reg_user in Registration.objects.all():
+                for userid, prjid, roleid in ks_assignments:
+                    if roleid != tnt_admin_roleid or not userid in reg_dict:
+                        continue
+                    if not prjid in prj_dict:
+                        continue
+                    regid, username, expdate = reg_dict[userid]
 
-                    if not reg_user.userid:
-                        LOG.info("Skipped unregistered user %s" % reg_user.username)
+                    if (regid, prjid) in role_keys:
                         continue
+                    role_keys.add((regid, prjid))
+
+                    new_roles.append(PrjRole(registration_id = regid,
+                                             project_id = prj_dict[prjid],
+                                             roleid = roleid))
 
-                    for role_obj in keystone_client.role_assignments.list(reg_user.userid):
-                        if role_obj.role['id'] == tnt_admin_roleid:
-                            tmpprjid = role_obj.scope['project']['id']
-                            prjRole = PrjRole()
-                            prjRole.registration = reg_user
-                            prjRole.project = prj_dict[tmpprjid]
-                            prjRole.roleid = role_obj.role['id']
-                            prjRole.save()
+                    LOG.info("Imported admin %s for %s" % (username, prj_dict[prjid]))
 
-                            LOG.info("Imported admin %s for %s" % (reg_user.username, 
-                                     prj_dict[tmpprjid].projectname))
+                PrjRole.objects.bulk_create(new_roles, batch_size = chunk_size)
 
         except:
             LOG.error("Import failed", exc_info=True)
             raise CommandError("Import failed")
-
@@ -0,0 +1,183 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import gzip
+import json
+import logging
+import os
+import os.path
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.core.management.base import CommandError
+
+from openstack_auth_shib.models import Log
+from openstack_auth_shib.models import LogExtra
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("purgelogs")
+
+ARCHIVE_COLUMNS = (
+    'id',
+    'log_type',
+    'action',
+    'user_id',
+    'user_name',
+    'project_id',
+    'project_name',
+    'dst_user_id',
+    'dst_project_id',
+    'message',
+)
+
+#
+# The state file records the cutoff, the archive and the last archived id,
+# an interrupted run is resumed from there without archiving rows twice
+#
+STATE_FILE = 'purgelogs.state'
+
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--days',
+                            dest='days',
+                            type=int,
+                            default=getattr(settings, 'LOG_MANAGER_RETENTION_DAYS', 365),
+                            help='Logs older than this number of days are purged')
+        parser.add_argument('--archive-dir',
+                            dest='archivedir',
+                            action='store',
+                            default=getattr(settings, 'LOG_MANAGER_ARCHIVE_DIR',
+                                            '/var/lib/openstack-auth-shib/logarchive'),
+                            help='The directory for the compressed archives')
+        parser.add_argument('--no-archive',
+                            dest='noarchive',
+                            action='store_true',
+                            default=False,
+                            help='Delete the logs without archiving them')
+        parser.add_argument('--batch-size',
+                            dest='batchsize',
+                            type=int,
+                            default=1000,
+                            help='Number of logs deleted in a single transaction')
+        parser.add_argument('--pause',
+                            dest='pause',
+                            type=float,
+                            default=0.1,
+                            help='Seconds between two batches')
+
+    def load_state(self, state_path):
+        try:
+            with open(state_path) as sfile:
+                return json.load(sfile)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, state_path, state):
+        tmpname = state_path + '.tmp'
+        with open(tmpname, 'w') as sfile:
+            json.dump(state, sfile)
+            sfile.flush()
+            os.fsync(sfile.fileno())
+        os.replace(tmpname, state_path)
+
+    def archive_batch(self, archive_path, batch, extra_table):
+        with gzip.open(archive_path, 'at', encoding='utf-8') as afile:
+            for log in batch:
+                item = dict((x, getattr(log, x)) for x in ARCHIVE_COLUMNS)
+                item['timestamp'] = log.timestamp.isoformat()
+                item['extra'] = extra_table.get(log.id, {})
+                afile.write(json.dumps(item) + '\n')
+            afile.flush()
+            os.fsync(afile.fileno())
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        archive_dir = options['archivedir']
+        batch_size = max(options['batchsize'], 1)
+        do_archive = not options['noarchive']
+
+        try:
+            state = None
+            state_path = os.path.join(archive_dir, STATE_FILE)
+            if do_archive:
+                os.makedirs(archive_dir, mode=0o750, exist_ok=True)
+                state = self.load_state(state_path)
+
+            if state:
+                cutoff = datetime.fromisoformat(state['cutoff'])
+                LOG.info("Resuming purge at id %d" % state['last_id'])
+            else:
+                cutoff = datetime.now(timezone.utc) - timedelta(days=options['days'])
+                state = {
+                    'cutoff' : cutoff.isoformat(),
+                    'archive' : 'logs-%s.jsonl.gz' % cutoff.strftime('%Y%m%d%H%M%S'),
+                    'last_id' : 0
+                }
+            archive_path = os.path.join(archive_dir, state['archive'])
+
+            LOG.info("Purging logs older than %s" % cutoff.isoformat())
+
+            n_rows = 0
+            t_start = time.monotonic()
+            queryset = Log.objects.filter(timestamp__lt=cutoff).order_by('id')
+
+            while True:
+                batch = list(queryset[:batch_size])
+                if len(batch) == 0:
+                    break
+                id_list = [ x.id for x in batch ]
+
+                if do_archive:
+                    to_archive = [ x for x in batch if x.id > state['last_id'] ]
+                    if len(to_archive):
+                        extra_table = dict()
+                        q_args = { 'log_id__in' : [ x.id for x in to_archive ] }
+                        for log_id, key, value in LogExtra.objects.filter(**q_args) \
+                                                          .values_list('log_id', 'key', 'value'):
+                            extra_table.setdefault(log_id, dict())[key] = value
+
+                        self.archive_batch(archive_path, to_archive, extra_table)
+                        state['last_id'] = to_archive[-1].id
+                        self.save_state(state_path, state)
+
+                with transaction.atomic():
+                    LogExtra.objects.filter(log_id__in = id_list).delete()
+                    Log.objects.filter(id__in = id_list).delete()
+
+                n_rows += len(batch)
+                elapsed = time.monotonic() - t_start
+                LOG.debug("Purged %d logs (%.1f rows/s)" % (n_rows, n_rows / elapsed if elapsed else 0))
+
+                if options['pause'] > 0:
+                    time.sleep(options['pause'])
+
+            if do_archive and os.path.exists(state_path):
+                os.unlink(state_path)
+
+            elapsed = time.monotonic() - t_start
+            LOG.info("Purged %d logs in %.1f s (%.1f rows/s)" % \
+                     (n_rows, elapsed, n_rows / elapsed if elapsed else 0))
+        except:
+            LOG.error("Log purge failed", exc_info=True)
+            raise CommandError("Log purge failed")
+
@@ -0,0 +1,41 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import logging
+import time
+
+from django.core.management.base import CommandError
+
+from openstack_auth_shib.logsearch import rebuild_log_index
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("rebuildlogindex")
+
+class Command(CloudVenetoCommand):
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        try:
+            LOG.info("Rebuilding the full-text index for logs")
+            t_start = time.monotonic()
+            rebuild_log_index()
+            LOG.info("Full-text index rebuilt in %.3f s" % (time.monotonic() - t_start))
+        except:
+            LOG.error("Cannot rebuild the full-text index", exc_info=True)
+            raise CommandError("Cannot rebuild the full-text index")
+
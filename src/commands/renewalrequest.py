@@ -19,9 +19,7 @@ from datetime import datetime, timedelta, timezone
 
 from django.db import transaction
 from django.core.management.base import CommandError
-from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import Expiration
-from openstack_auth_shib.models import Project
 from openstack_auth_shib.models import PrjRequest
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import PrjRole
@@ -29,8 +27,10 @@ from openstack_auth_shib.models import PSTATUS_RENEW_ADMIN
 from openstack_auth_shib.models import PSTATUS_RENEW_MEMB
 from openstack_auth_shib.models import PSTATUS_RENEW_ATTEMPT
 from openstack_auth_shib.models import PSTATUS_RENEW_DISC
+from openstack_auth_shib.models import LogBuffer
 
 from openstack_auth_shib.notifications import notifyUser
+from openstack_auth_shib.notifications import NotificationBatch
 from openstack_auth_shib.notifications import notifyAdmin
 from openstack_auth_shib.notifications import PROPOSED_RENEWAL
 from openstack_auth_shib.notifications import USER_NEED_RENEW
@@ -52,67 +52,85 @@ class Command(CloudVenetoCommand):
 
         try:
 
-            new_reqs = dict()
-            mail_table = dict()
+            new_reqs = list()
 
             with transaction.atomic():
 
-                stored_reqs = set()
                 renew_status_list = [
                     PSTATUS_RENEW_ADMIN,
                     PSTATUS_RENEW_MEMB,
                     PSTATUS_RENEW_ATTEMPT,
                     PSTATUS_RENEW_DISC
                 ]
-                for prj_req in PrjRequest.objects.filter(flowstatus__in=renew_status_list):
-                    stored_reqs.add((prj_req.registration.regid, prj_req.project.projectname))
-
-                for e_item in Expiration.objects.filter(expdate__lte=exp_date, expdate__gt=now):
-
-                    regid = e_item.registration.regid
-                    if not (regid, e_item.project.projectname) in stored_reqs:
-
-                        q_args = {
-                            'registration' : e_item.registration,
-                            'project' : e_item.project
+                r_set = PrjRequest.objects.filter(flowstatus__in=renew_status_list)
+                stored_reqs = set(r_set.values_list('registration_id', 'project_id'))
+
+                exp_set = Expiration.objects.filter(expdate__lte=exp_date, expdate__gt=now)
+                exp_regs = exp_set.values('registration')
+
+                a_set = PrjRole.objects.filter(registration__in=exp_regs)
+                admin_pairs = set(a_set.values_list('registration_id', 'project_id'))
+
+                mail_table = dict()
+                m_set = EMail.objects.filter(registration__in=exp_regs).order_by('id')
+                for regid, email in m_set.values_list('registration_id', 'email'):
+                    mail_table.setdefault(regid, email)
+
+                exp_fields = (
+                    'registration_id',
+                    'project_id',
+                    'expdate',
+                    'registration__username',
+                    'registration__userid',
+                    'project__projectid'
+                )
+                for e_item in exp_set.values_list(*exp_fields):
+
+                    req_key = e_item[0:2]
+                    if req_key in stored_reqs:
+                        continue
+                    stored_reqs.add(req_key)
+
+                    new_reqs.append({
+                        'regid' : e_item[0],
+                        'projectname' : e_item[1],
+                        'username' : e_item[3],
+                        'userid' : e_item[4],
+                        'projectid' : e_item[5],
+                        'email' : mail_table.get(e_item[0], None),
+                        'f_exp' : e_item[2].date().isoformat(),
+                        'is_admin' : req_key in admin_pairs
+                    })
+
+                PrjRequest.objects.bulk_create([
+                    PrjRequest(
+                        registration_id = req_data['regid'],
+                        project_id = req_data['projectname'],
+                        notes = req_data['f_exp'],
+                        flowstatus = PSTATUS_RENEW_ADMIN if req_data['is_admin'] else PSTATUS_RENEW_ATTEMPT
+                    ) for req_data in new_reqs
+                ])
+
+            for req_data in new_reqs:
+                LOG.info("Issued proposed renewal for %s" % req_data['username'])
+
+            with NotificationBatch(), LogBuffer():
+                for req_data in new_reqs:
+                    try:
+                        noti_params = {
+                            'username' : req_data['username'],
+                            'project' : req_data['projectname']
                         }
-                        is_admin = (PrjRole.objects.filter(**q_args).count() > 0)
-
-                        if not regid in mail_table:
-                            tmpobj = EMail.objects.filter(registration=e_item.registration)
-                            mail_table[regid] = tmpobj[0].email if len(tmpobj) else None
-
-                        f_exp = e_item.expdate.date().isoformat()
-
-                        new_reqs[(e_item.registration, e_item.project)] = (mail_table[regid], f_exp, is_admin)
-
-                for req_pair, req_data in new_reqs.items():
-                    reqArgs = {
-                        'registration' : req_pair[0],
-                        'project' : req_pair[1],
-                        'notes' : req_data[1],
-                        'flowstatus' : PSTATUS_RENEW_ADMIN if req_data[2] else PSTATUS_RENEW_ATTEMPT
-                    }
-                    PrjRequest(**reqArgs).save()
-
-                    LOG.info("Issued proposed renewal for %s" % req_pair[0].username)
-
-            for req_pair, req_data in new_reqs.items():
-                try:
-                    noti_params = {
-                        'username' : req_pair[0].username,
-                        'project' : req_pair[1].projectname
-                    }
-                    if req_data[2]:
-                        notifyAdmin(USER_NEED_RENEW, noti_params, user_id=req_pair[0].userid,
-                                    project_id=req_pair[1].projectid,
-                                    dst_project_id=req_pair[1].projectid)
-                    else:
-                        notifyUser(req_data[0], PROPOSED_RENEWAL, noti_params,
-                                   project_id=req_pair[1].projectid,
-                                   dst_user_id=req_pair[0].userid)
-                except:
-                    LOG.error("Cannot notify %s" % req_pair[0].username, exc_info=True)
+                        if req_data['is_admin']:
+                            notifyAdmin(USER_NEED_RENEW, noti_params, user_id=req_data['userid'],
+                                        project_id=req_data['projectid'],
+                                        dst_project_id=req_data['projectid'])
+                        else:
+                            notifyUser(req_data['email'], PROPOSED_RENEWAL, noti_params,
+                                       project_id=req_data['projectid'],
+                                       dst_user_id=req_data['userid'])
+                    except:
+                        LOG.error("Cannot notify %s" % req_data['username'], exc_info=True)
         except:
             LOG.error("Proposed renewal failed", exc_info=True)
             raise CommandError("Proposed renewal failed")
@@ -0,0 +1,51 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import logging
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from openstack_auth_shib.models import LogBuffer
+from openstack_auth_shib.notifications import NotificationBatch
+from openstack_auth_shib.notifications import send_digests
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("senddigest")
+
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--window',
+                            dest='window',
+                            type=int,
+                            default=getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', 60),
+                            help='Minutes a notification waits in the digest before sending')
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        try:
+            with NotificationBatch(), LogBuffer():
+                n_digests = send_digests(options['window'])
+            if n_digests:
+                LOG.info("Sent %d digests" % n_digests)
+        except:
+            LOG.error("Cannot send digests", exc_info=True)
+            raise CommandError("Cannot send digests")
+
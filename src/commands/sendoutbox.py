@@ -0,0 +1,90 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import logging
+import time
+
+from django.core.management.base import CommandError
+
+from openstack_auth_shib.notifications import send_outbox
+
+from horizon.management.commands.cronscript_utils import CloudVenetoCommand
+
+LOG = logging.getLogger("sendoutbox")
+
+class Command(CloudVenetoCommand):
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--batch-size',
+                            dest='batchsize',
+                            type=int,
+                            default=100,
+                            help='Number of notifications sent over a single connection')
+        parser.add_argument('--max-attempts',
+                            dest='maxattempts',
+                            type=int,
+                            default=10,
+                            help='Number of attempts before discarding a notification')
+        parser.add_argument('--backoff',
+                            dest='backoff',
+                            type=int,
+                            default=60,
+                            help='Initial delay in seconds before retrying a delivery')
+        parser.add_argument('--lease',
+                            dest='lease',
+                            type=int,
+                            default=600,
+                            help='Seconds a claimed batch is reserved to this worker')
+        parser.add_argument('--loop',
+                            dest='loop',
+                            type=int,
+                            default=0,
+                            help='Run as a worker, polling the outbox every N seconds')
+
+    def drain(self, options):
+        n_sent = 0
+        n_failed = 0
+        while True:
+            b_sent, b_failed = send_outbox(batch_size=options['batchsize'],
+                                           max_attempts=options['maxattempts'],
+                                           backoff=options['backoff'],
+                                           lease=options['lease'])
+            n_sent += b_sent
+            n_failed += b_failed
+            if b_sent + b_failed < options['batchsize'] or b_sent == 0:
+                break
+        if n_sent or n_failed:
+            LOG.info("Sent %d notifications, %d failures" % (n_sent, n_failed))
+
+    def handle(self, *args, **options):
+
+        super(Command, self).handle(options)
+
+        if options['loop'] <= 0:
+            try:
+                self.drain(options)
+            except:
+                LOG.error("Cannot send notifications", exc_info=True)
+                raise CommandError("Cannot send notifications")
+            return
+
+        while True:
+            try:
+                self.drain(options)
+            except:
+                LOG.error("Cannot send notifications", exc_info=True)
+            time.sleep(options['loop'])
+
@@ -12,6 +12,13 @@ WEBSSO_IDP_ENTITIES = {}
 WEBSSO_IDP_RULES = {}
 WEBSSO_CHOICES = (("credentials", "Keystone Credentials"),)
 
+# Reconcile the keystone federation setup with the WEBSSO_IDP_* settings
+# at the login of an administrator. The check is guarded by a lock in the
+# Django cache: CACHES must use a shared backend (memcached, redis or the
+# database), with LocMemCache every worker runs the check on its own.
+CHECK_FEDERATION_SETUP = False
+FEDERATION_CHECK_TTL = 3600
+
 HORIZON_CONFIG['identity_providers'] = {}
 
 HORIZON_CONFIG['help_url'] = 'http://userguide.cloudveneto.it/'
@@ -38,6 +38,7 @@ class LogFilterAction(tables.FilterAction):
         ("user_name", _("User Name ="), True),
         ("user_id", _("User ID ="), True),
         ("message__icontains", _("Full text"), True),
+        ("fulltext", _("Full text (indexed)"), True),
     )
 
 
@@ -121,3 +122,5 @@ class MainTable(tables.DataTable):
         verbose_name = _("Logs")
         multi_select = False
         table_actions = (LogFilterAction, )
+        pagination_param = "log_marker"
+        prev_pagination_param = "prev_log_marker"
@@ -21,6 +21,7 @@ from openstack_dashboard.dashboards.idmanager.log_manager import views
 
 urlpatterns = [
     url(r'^$', views.MainView.as_view(), name='index'),
+    url(r'^export/$', views.ExportView.as_view(), name='export'),
     url(r'^(?P<log_id>[^/]+)/detail/$', views.DetailView.as_view(), name='detail')
 ]
 
@@ -17,10 +17,17 @@
 #  under the License.
 
 
-import logging
+import csv
 import datetime
+import json
+import logging
+import zlib
+from urllib.parse import urlencode
 
 from django.db import transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.views import generic
 from django.urls import reverse
 from django.conf import settings
 from django.utils import timezone
@@ -34,8 +41,10 @@ from horizon.utils import memoized
 from openstack_dashboard import api
 
 from openstack_auth_shib.models import Log
+from openstack_auth_shib.models import LogExtra
 from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import Project
+from openstack_auth_shib.logsearch import search_logs
 from openstack_auth_shib.notifications import LOG_TYPE_EMAIL
 from .tables import MainTable
 
@@ -145,11 +154,50 @@ def _get_user_name(request, user_id):
     return user_name
 
 
-class MainView(tables.DataTableView):
+# Columns rendered by MainTable
+LOG_COLUMNS = (
+    'id',
+    'timestamp',
+    'action',
+    'message',
+    'user_id',
+    'user_name',
+    'project_id',
+    'project_name',
+    'dst_user_id',
+    'dst_project_id',
+)
+
+
+class MainView(tables.PagedTableMixin, tables.DataTableView):
     table_class = MainTable
     template_name = 'idmanager/log_manager/log_manager.html'
     page_title = _("Logs")
 
+    def get_page_size(self):
+        return getattr(settings, 'LOG_MANAGER_PAGE_SIZE', 100)
+
+    def get_keyset(self, queryset, marker, sort_dir):
+        # Keyset pagination on (timestamp, id), the marker is the id
+        # of the last (or first) row of the current page
+        try:
+            marker = int(marker)
+        except (TypeError, ValueError):
+            return queryset.order_by('-timestamp', '-id'), False
+
+        m_ts = Log.objects.filter(id=marker).values_list('timestamp', flat=True).first()
+        if m_ts is None:
+            return queryset.order_by('-timestamp', '-id'), False
+
+        if sort_dir == 'asc':
+            queryset = queryset.filter(Q(timestamp__gt=m_ts) |
+                                       Q(timestamp=m_ts, id__gt=marker))
+            return queryset.order_by('timestamp', 'id'), True
+
+        queryset = queryset.filter(Q(timestamp__lt=m_ts) |
+                                   Q(timestamp=m_ts, id__lt=marker))
+        return queryset.order_by('-timestamp', '-id'), True
+
     def get_data(self):
         logs = []
 
@@ -157,12 +205,32 @@ class MainView(tables.DataTableView):
         start, end = self.date_range.get_date_range()
 
         filters = self.get_filters()
+        # the active table filter is forwarded to the export links
+        self.export_filters = dict((k, v) for k, v in filters.items() if k in EXPORT_FILTERS)
         filters['timestamp__gte'] = start
         filters['timestamp__lte'] = end
+        search_text = filters.pop('fulltext', None)
+
+        marker, sort_dir = self._get_marker()
+        page_size = self.get_page_size()
 
         with transaction.atomic():
             try:
-                values = Log.objects.filter(**filters)
+                queryset = Log.objects.filter(**filters).only(*LOG_COLUMNS)
+                if search_text:
+                    queryset = search_logs(queryset, search_text)
+                queryset, paged = self.get_keyset(queryset, marker, sort_dir)
+                values = list(queryset[:page_size + 1])
+
+                has_more = len(values) > page_size
+                values = values[:page_size]
+                if paged and sort_dir == 'asc':
+                    values.reverse()
+                    self._has_prev_data = has_more
+                    self._has_more_data = True
+                else:
+                    self._has_prev_data = paged
+                    self._has_more_data = has_more
 
                 usr_set = set()
                 usr_table = dict()
@@ -205,6 +273,7 @@ class MainView(tables.DataTableView):
     def get_context_data(self, **kwargs):
         context = super(MainView, self).get_context_data(**kwargs)
         context['form'] = self.date_range.form
+        context['export_query'] = urlencode(getattr(self, 'export_filters', {}))
 
         return context
 
@@ -266,3 +335,124 @@ class DetailView(views.HorizonTemplateView):
 
     def get_redirect_url(self):
         return reverse('horizon:idmanager:log_manager:index')
+
+
+# Fields accepted as filters by the export view
+EXPORT_FILTERS = (
+    'action',
+    'project_name',
+    'project_id',
+    'user_name',
+    'user_id',
+    'message__icontains',
+    'fulltext',
+)
+
+EXPORT_COLUMNS = (
+    'id',
+    'timestamp',
+    'log_type',
+    'action',
+    'user_id',
+    'user_name',
+    'project_id',
+    'project_name',
+    'dst_user_id',
+    'dst_project_id',
+    'message',
+)
+
+
+class _LineBuffer(object):
+    def write(self, value):
+        return value
+
+
+class ExportView(generic.View):
+
+    def get_rows(self, queryset, chunk_size):
+        # Keyset batches on the primary key: the memory usage does not
+        # depend on the number of rows, even where the DB driver cannot
+        # stream the results of a single query
+        last_id = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id)
+                                 .order_by('id')[:chunk_size]
+                                 .iterator(chunk_size=chunk_size))
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            extra_table = dict()
+            q_args = {'log_id__in': [x.id for x in chunk]}
+            for log_id, key, value in LogExtra.objects.filter(**q_args) \
+                                                      .values_list('log_id', 'key', 'value'):
+                extra_table.setdefault(log_id, dict())[key] = value
+
+            for log in chunk:
+                yield log, extra_table.get(log.id, {})
+
+    def format_csv(self, rows):
+        writer = csv.writer(_LineBuffer())
+        yield writer.writerow(EXPORT_COLUMNS + ('extra',))
+        for log, extra in rows:
+            values = [getattr(log, x) for x in EXPORT_COLUMNS]
+            values[1] = log.timestamp.isoformat()
+            values.append(json.dumps(extra) if extra else '')
+            yield writer.writerow(values)
+
+    def format_jsonl(self, rows):
+        for log, extra in rows:
+            item = dict((x, getattr(log, x)) for x in EXPORT_COLUMNS)
+            item['timestamp'] = log.timestamp.isoformat()
+            item['extra'] = extra
+            yield json.dumps(item) + '\n'
+
+    def compress(self, lines):
+        compressor = zlib.compressobj(wbits=31)
+        for line in lines:
+            data = compressor.compress(line.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def get(self, request, *args, **kwargs):
+        date_range = DateRange(request)
+        start, end = date_range.get_date_range()
+
+        filters = dict()
+        for f_name in EXPORT_FILTERS:
+            if request.GET.get(f_name):
+                filters[f_name] = request.GET[f_name]
+        filters['timestamp__gte'] = start
+        filters['timestamp__lte'] = end
+        search_text = filters.pop('fulltext', None)
+
+        queryset = Log.objects.filter(**filters)
+        if search_text:
+            queryset = search_logs(queryset, search_text)
+
+        chunk_size = getattr(settings, 'LOG_MANAGER_EXPORT_CHUNK', 2000)
+        rows = self.get_rows(queryset, chunk_size)
+
+        if request.GET.get('format', 'csv') == 'jsonl':
+            lines = self.format_jsonl(rows)
+            content_type = 'application/x-ndjson'
+            extension = 'jsonl'
+        else:
+            lines = self.format_csv(rows)
+            content_type = 'text/csv'
+            extension = 'csv'
+
+        filename = 'logs-%s-%s.%s' % (start.strftime('%Y%m%d'),
+                                      end.strftime('%Y%m%d'), extension)
+
+        if request.GET.get('gzip'):
+            response = StreamingHttpResponse(self.compress(lines),
+                                             content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(lines, content_type=content_type)
+
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
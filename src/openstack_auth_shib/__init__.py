@@ -22,5 +22,6 @@ __all__ = [
     "forms",
     "idpmanager",
     "notifications",
+    "logsearch",
     "utils"
 ]
@@ -13,22 +13,78 @@
 #  License for the specific language governing permissions and limitations
 #  under the License. 
 
+import hashlib
+import json
 import logging
+import threading
 from urllib.parse import urlencode
 
 from django.conf import settings
+from django.core.cache import cache
 
 from openstack_dashboard.api import keystone as keystone_api
-from keystone.federation import utils as federation_utils
 
+from .lazyimport import LazyModule
 
 LOG = logging.getLogger(__name__)
 
-class Federated_Account:
+federation_utils = LazyModule('keystone.federation.utils')
 
-    entity_table = getattr(settings, 'WEBSSO_IDP_ENTITIES', {})
-    mapping_table = getattr(settings, 'WEBSSO_IDP_MAPPING', {})
-    rule_table = getattr(settings, 'WEBSSO_IDP_RULES', {})
+def getIdPSettings():
+    return (getattr(settings, 'WEBSSO_IDP_ENTITIES', {}),
+            getattr(settings, 'WEBSSO_IDP_MAPPING', {}),
+            getattr(settings, 'WEBSSO_IDP_RULES', {}))
+
+def federationSettingsHash(idp_settings=None):
+    if idp_settings is None:
+        idp_settings = getIdPSettings()
+    s_dump = json.dumps(idp_settings, sort_keys=True, default=str)
+    return hashlib.sha256(s_dump.encode('utf-8')).hexdigest()
+
+#
+# Reverse index: entity id -> (idp id, mapping id, rule processor)
+# The index is built once per process, on the first lookup: the
+# WEBSSO_IDP_* settings don't change at runtime
+#
+class IdPIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.table = None
+
+    def _build(self, entity_table, mapping_table, rule_table):
+        map_table = dict()
+        for map_id, map_data in mapping_table.items():
+            map_table.setdefault(map_data[0], map_id)
+
+        result = dict()
+        for idp_id, entity_list in entity_table.items():
+            map_id = map_table.get(idp_id, None)
+            ruleproc = None
+            if map_id:
+                try:
+                    ruleproc = federation_utils.RuleProcessor(map_id,
+                                                              rule_table.get(map_id, []))
+                except Exception as exc:
+                    LOG.error("Cannot compile rules for %s" % map_id, exc_info=True)
+                    map_id = None
+
+            if isinstance(entity_list, str):
+                entity_list = [ entity_list ]
+            for entity_id in entity_list:
+                result.setdefault(entity_id, (idp_id, map_id, ruleproc))
+        return result
+
+    def lookup(self, entity_id):
+        if self.table is None:
+            with self.lock:
+                if self.table is None:
+                    self.table = self._build(*getIdPSettings())
+        return self.table.get(entity_id, None)
+
+IDP_INDEX = IdPIndex()
+
+class Federated_Account:
 
     idp_equiv = getattr(settings, 'IDP_EQUIV', {
         'studenti.unipd.it' : 'unipd.it'
@@ -64,28 +120,21 @@ class Federated_Account:
             self.provider = request.META.get('OIDC-organisation_name', 'Unknown')
 
         if self.idpid and not self.username:
-            step1 = list(x for x in Federated_Account.entity_table.items()
-                         if self.idpid in x[1])
-            if len(step1) > 0:
-                step2 = list(x for x in Federated_Account.mapping_table.items()
-                             if step1[0][0] == x[1][0])
-                if len(step2) > 0:
-                    rules = Federated_Account.rule_table.get(step2[0][0], [])
-
-                    try:
-                        ruleproc = federation_utils.RuleProcessor(step2[0][0], rules)
-                        res = ruleproc.process(request.META)
-                        if res and 'user' in res:
-                            self.username = res['user']['name']
-                            LOG.debug("Found account: %s" % self.username)
-                        else:
-                            LOG.debug("No rule for %s" % step2[0][0])
-                    except Exception as exc:
-                        LOG.debug(str(exc), exc_info=True)
-                else:
-                    LOG.debug("No mapping for %s" % step1[0][0])
-            else:
+            idp_entry = IDP_INDEX.lookup(self.idpid)
+            if not idp_entry:
                 LOG.debug("No identity provider for %s" % self.idpid)
+            elif not idp_entry[1]:
+                LOG.debug("No mapping for %s" % idp_entry[0])
+            else:
+                try:
+                    res = idp_entry[2].process(request.META)
+                    if res and 'user' in res:
+                        self.username = res['user']['name']
+                        LOG.debug("Found account: %s" % self.username)
+                    else:
+                        LOG.debug("No rule for %s" % idp_entry[1])
+                except Exception as exc:
+                    LOG.debug(str(exc), exc_info=True)
 
         self.email = None
         for m_item in ['mail', 'OIDC-email']:
@@ -131,53 +180,116 @@ def postproc_logout(request, response):
     return response
 
 
-def checkFederationSetup(request):
+#
+# The federation setup in keystone is reconciled with the WEBSSO_IDP_*
+# settings; the hash of the settings last verified is stored in the shared
+# cache as a marker, so that keystone is queried again only when the
+# settings change or the marker expires (FEDERATION_CHECK_TTL seconds).
+# The marker and the lock (cache.add) work across processes only with a
+# shared cache backend (memcached, redis, database); with LocMemCache each
+# worker keeps its own copy and may run the check concurrently.
+#
+FEDERATION_MARKER = 'openstack_auth_shib_federation_setup'
+FEDERATION_LOCK = 'openstack_auth_shib_federation_lock'
 
-    if not getattr(settings, 'CHECK_FEDERATION_SETUP', False):
-        return
+#
+# Results of checkFederationSetup
+#
+FEDERATION_DISABLED = 0
+FEDERATION_VERIFIED = 1
+FEDERATION_BUSY = 2
+FEDERATION_RECONCILED = 3
+FEDERATION_FAILED = 4
+
+def reconcileFederationSetup(kclient):
 
     mapping_table = getattr(settings, 'WEBSSO_IDP_MAPPING', {})
     entity_table = getattr(settings, 'WEBSSO_IDP_ENTITIES', {})
     rule_table = getattr(settings, 'WEBSSO_IDP_RULES', {})
-    
+
+    result = True
+
     try:
         tmp_table = entity_table.copy()
-        for idp_item in keystone_api.identity_provider_list(request):
+        for idp_item in kclient.federation.identity_providers.list():
             tmp_table.pop(idp_item.id, None)
             LOG.debug("Found provider %s" % idp_item.id)
 
         for idp_id in tmp_table:
-            keystone_api.identity_provider_create(request, idp_id, None, True, 
-                                                  tmp_table.get(idp_id, []))
-            LOG.debug("Created provider %s" % idp_id)
+            kclient.federation.identity_providers.create(id=idp_id, enabled=True,
+                                                         remote_ids=tmp_table.get(idp_id, []))
+            LOG.info("Created provider %s" % idp_id)
     except:
         LOG.error("Cannot setup identity providers", exc_info=True)
-    
+        result = False
 
     try:
-        for map_item in keystone_api.mapping_list(request):
-            rule_table.pop(map_item.id, None)
+        tmp_table = rule_table.copy()
+        for map_item in kclient.federation.mappings.list():
+            tmp_table.pop(map_item.id, None)
             LOG.debug("Found mapping %s" % map_item.id)
 
-        for map_id in rule_table:
-            keystone_api.mapping_create(request, map_id, rule_table.get(map_id, []))
-            LOG.debug("Created mapping %s" % map_id)
+        for map_id in tmp_table:
+            kclient.federation.mappings.create(mapping_id=map_id,
+                                               rules=tmp_table.get(map_id, []))
+            LOG.info("Created mapping %s" % map_id)
     except:
         LOG.error("Cannot setup rules", exc_info=True)
+        result = False
 
     try:
+        # one protocol listing for each identity provider
+        idp_protocols = dict()
         for map_id in mapping_table:
             idp_id, proto_id = mapping_table[map_id]
-            missing = True
-            for proto_item in keystone_api.protocol_list(request, idp_id):
-                if proto_item.mapping_id == map_id:
-                    LOG.debug("Found protocol %s" % map_id)
-                    missing = False
-                    break
-
-            if missing:
-                keystone_api.protocol_create(request, proto_id, idp_id, map_id)
-                LOG.debug("Found protocol %s %s" % (proto_id, map_id))
+            if not idp_id in idp_protocols:
+                idp_protocols[idp_id] = set(
+                    x.mapping_id for x in kclient.federation.protocols.list(idp_id)
+                )
+
+            if map_id in idp_protocols[idp_id]:
+                LOG.debug("Found protocol %s" % map_id)
+                continue
+
+            kclient.federation.protocols.create(protocol_id=proto_id,
+                                                identity_provider=idp_id,
+                                                mapping=map_id)
+            idp_protocols[idp_id].add(map_id)
+            LOG.info("Created protocol %s %s" % (proto_id, map_id))
     except:
         LOG.error("Cannot setup protocols", exc_info=True)
+        result = False
+
+    return result
+
+def checkFederationSetup(request=None, kclient=None, force=False):
+
+    if kclient is None and not getattr(settings, 'CHECK_FEDERATION_SETUP', False):
+        return FEDERATION_DISABLED
+
+    try:
+        s_hash = federationSettingsHash()
+        if not force and cache.get(FEDERATION_MARKER) == s_hash:
+            return FEDERATION_VERIFIED
+
+        # only one worker at a time runs the reconciliation
+        if not cache.add(FEDERATION_LOCK, s_hash, 300):
+            return FEDERATION_BUSY
+    except:
+        LOG.error("Cannot check the federation marker", exc_info=True)
+        return FEDERATION_FAILED
+
+    result = FEDERATION_FAILED
+    try:
+        if kclient is None:
+            kclient = keystone_api.keystoneclient(request, admin=True)
+        if reconcileFederationSetup(kclient):
+            cache.set(FEDERATION_MARKER, s_hash,
+                      getattr(settings, 'FEDERATION_CHECK_TTL', 3600))
+            result = FEDERATION_RECONCILED
+    except:
+        LOG.error("Cannot reconcile the federation setup", exc_info=True)
+    finally:
+        cache.delete(FEDERATION_LOCK)
 
+    return result
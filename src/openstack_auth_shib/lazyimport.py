@@ -0,0 +1,40 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import importlib
+import threading
+
+#
+# Proxy for heavy modules (e.g. the keystone server package):
+# the module is imported on the first attribute access instead of at load time,
+# so that WSGI workers and cron commands not using it don't pay for the import.
+#
+class LazyModule:
+
+    def __init__(self, mod_name):
+        self._mod_name = mod_name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._mod_name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
@@ -0,0 +1,205 @@
+#  Copyright (c) 2014 INFN - "Istituto Nazionale di Fisica Nucleare" - Italy
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License. 
+
+import logging
+import re
+
+from django.db import connections
+from django.db import router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Log
+from .models import LogExtra
+
+LOG = logging.getLogger(__name__)
+
+#
+# Full-text search for Log.message and LogExtra.value,
+# based on the native index of each database vendor
+#
+WORD_REGEX = re.compile(r'\w+', re.UNICODE)
+
+LOG_TABLE = Log._meta.db_table
+EXTRA_TABLE = LogExtra._meta.db_table
+
+MYSQL_LOG_INDEX = 'log_message_fts'
+MYSQL_EXTRA_INDEX = 'logextra_value_fts'
+PGSQL_LOG_INDEX = 'log_message_fts'
+PGSQL_EXTRA_INDEX = 'logextra_value_fts'
+SQLITE_LOG_TABLE = LOG_TABLE + '_fts'
+SQLITE_EXTRA_TABLE = EXTRA_TABLE + '_fts'
+
+def get_words(text):
+    return WORD_REGEX.findall(text or '')
+
+class SearchBackend:
+
+    vendor = None
+
+    def create_index(self, cursor):
+        pass
+
+    def drop_index(self, cursor):
+        pass
+
+    def rebuild_index(self, cursor):
+        pass
+
+    def search(self, queryset, text):
+        words = get_words(text)
+        if len(words) == 0:
+            return queryset
+
+        msg_filter = Q()
+        extra_filter = Q()
+        for word in words:
+            msg_filter &= Q(message__icontains=word)
+            extra_filter &= Q(value__icontains=word)
+        extra_ids = LogExtra.objects.filter(extra_filter).values('log_id')
+        return queryset.filter(msg_filter | Q(id__in=extra_ids))
+
+class MySQLBackend(SearchBackend):
+
+    vendor = 'mysql'
+
+    def create_index(self, cursor):
+        cursor.execute("CREATE FULLTEXT INDEX %s ON %s (message)" % (MYSQL_LOG_INDEX, LOG_TABLE))
+        cursor.execute("CREATE FULLTEXT INDEX %s ON %s (value)" % (MYSQL_EXTRA_INDEX, EXTRA_TABLE))
+
+    def drop_index(self, cursor):
+        cursor.execute("DROP INDEX %s ON %s" % (MYSQL_LOG_INDEX, LOG_TABLE))
+        cursor.execute("DROP INDEX %s ON %s" % (MYSQL_EXTRA_INDEX, EXTRA_TABLE))
+
+    def rebuild_index(self, cursor):
+        cursor.execute("OPTIMIZE TABLE %s, %s" % (LOG_TABLE, EXTRA_TABLE))
+        cursor.fetchall()
+
+    def search(self, queryset, text):
+        words = get_words(text)
+        if len(words) == 0:
+            return queryset
+
+        query = ' '.join('+%s*' % x for x in words)
+        msg_ids = RawSQL("SELECT id FROM %s WHERE MATCH(message) AGAINST (%%s IN BOOLEAN MODE)"
+                         % LOG_TABLE, (query,))
+        extra_ids = RawSQL("SELECT log_id FROM %s WHERE MATCH(value) AGAINST (%%s IN BOOLEAN MODE)"
+                           % EXTRA_TABLE, (query,))
+        return queryset.filter(Q(id__in=msg_ids) | Q(id__in=extra_ids))
+
+class PostgreSQLBackend(SearchBackend):
+
+    vendor = 'postgresql'
+
+    def create_index(self, cursor):
+        cursor.execute("CREATE INDEX %s ON %s USING GIN (to_tsvector('simple', message))"
+                       % (PGSQL_LOG_INDEX, LOG_TABLE))
+        cursor.execute("CREATE INDEX %s ON %s USING GIN (to_tsvector('simple', value))"
+                       % (PGSQL_EXTRA_INDEX, EXTRA_TABLE))
+
+    def drop_index(self, cursor):
+        cursor.execute("DROP INDEX IF EXISTS %s" % PGSQL_LOG_INDEX)
+        cursor.execute("DROP INDEX IF EXISTS %s" % PGSQL_EXTRA_INDEX)
+
+    def rebuild_index(self, cursor):
+        cursor.execute("REINDEX INDEX %s" % PGSQL_LOG_INDEX)
+        cursor.execute("REINDEX INDEX %s" % PGSQL_EXTRA_INDEX)
+
+    def search(self, queryset, text):
+        words = get_words(text)
+        if len(words) == 0:
+            return queryset
+
+        query = ' & '.join('%s:*' % x for x in words)
+        msg_ids = RawSQL("SELECT id FROM %s WHERE to_tsvector('simple', message) "
+                         "@@ to_tsquery('simple', %%s)" % LOG_TABLE, (query,))
+        extra_ids = RawSQL("SELECT log_id FROM %s WHERE to_tsvector('simple', value) "
+                           "@@ to_tsquery('simple', %%s)" % EXTRA_TABLE, (query,))
+        return queryset.filter(Q(id__in=msg_ids) | Q(id__in=extra_ids))
+
+#
+# FTS5 external content tables, kept in sync by triggers
+#
+class SQLiteBackend(SearchBackend):
+
+    vendor = 'sqlite'
+
+    def _create_fts(self, cursor, fts_table, src_table, column):
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', content_rowid='id')"
+                       % (fts_table, column, src_table))
+        cursor.execute("CREATE TRIGGER %s_ai AFTER INSERT ON %s BEGIN "
+                       "INSERT INTO %s(rowid, %s) VALUES (new.id, new.%s); END"
+                       % (fts_table, src_table, fts_table, column, column))
+        cursor.execute("CREATE TRIGGER %s_ad AFTER DELETE ON %s BEGIN "
+                       "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, old.%s); END"
+                       % (fts_table, src_table, fts_table, fts_table, column, column))
+        cursor.execute("CREATE TRIGGER %s_au AFTER UPDATE ON %s BEGIN "
+                       "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, old.%s); "
+                       "INSERT INTO %s(rowid, %s) VALUES (new.id, new.%s); END"
+                       % (fts_table, src_table, fts_table, fts_table, column, column,
+                          fts_table, column, column))
+        cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts_table, fts_table))
+
+    def _drop_fts(self, cursor, fts_table):
+        for suffix in [ 'ai', 'ad', 'au' ]:
+            cursor.execute("DROP TRIGGER IF EXISTS %s_%s" % (fts_table, suffix))
+        cursor.execute("DROP TABLE IF EXISTS %s" % fts_table)
+
+    def create_index(self, cursor):
+        self._create_fts(cursor, SQLITE_LOG_TABLE, LOG_TABLE, 'message')
+        self._create_fts(cursor, SQLITE_EXTRA_TABLE, EXTRA_TABLE, 'value')
+
+    def drop_index(self, cursor):
+        self._drop_fts(cursor, SQLITE_LOG_TABLE)
+        self._drop_fts(cursor, SQLITE_EXTRA_TABLE)
+
+    def rebuild_index(self, cursor):
+        for fts_table in [ SQLITE_LOG_TABLE, SQLITE_EXTRA_TABLE ]:
+            cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts_table, fts_table))
+            cursor.execute("INSERT INTO %s(%s) VALUES ('optimize')" % (fts_table, fts_table))
+
+    def search(self, queryset, text):
+        words = get_words(text)
+        if len(words) == 0:
+            return queryset
+
+        query = ' '.join('"%s"*' % x for x in words)
+        msg_ids = RawSQL("SELECT rowid FROM %s WHERE %s MATCH %%s"
+                         % (SQLITE_LOG_TABLE, SQLITE_LOG_TABLE), (query,))
+        extra_ids = RawSQL("SELECT log_id FROM %s WHERE id IN "
+                           "(SELECT rowid FROM %s WHERE %s MATCH %%s)"
+                           % (EXTRA_TABLE, SQLITE_EXTRA_TABLE, SQLITE_EXTRA_TABLE), (query,))
+        return queryset.filter(Q(id__in=msg_ids) | Q(id__in=extra_ids))
+
+BACKEND_TABLE = {
+    MySQLBackend.vendor : MySQLBackend(),
+    PostgreSQLBackend.vendor : PostgreSQLBackend(),
+    SQLiteBackend.vendor : SQLiteBackend(),
+}
+
+def get_backend(vendor):
+    return BACKEND_TABLE.get(vendor, SearchBackend())
+
+def get_log_connection():
+    return connections[router.db_for_read(Log)]
+
+def search_logs(queryset, text):
+    return get_backend(connections[queryset.db].vendor).search(queryset, text)
+
+def rebuild_log_index():
+    connection = get_log_connection()
+    with connection.cursor() as cursor:
+        get_backend(connection.vendor).rebuild_index(cursor)
+
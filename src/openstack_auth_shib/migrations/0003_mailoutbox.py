@@ -0,0 +1,30 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openstack_auth_shib', '0002_prj_attribute'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('attempts', models.IntegerField(default=0)),
+                ('status', models.IntegerField(db_index=True, default=0)),
+                ('sender', models.CharField(max_length=255)),
+                ('recipients', models.TextField()),
+                ('reply_to', models.TextField(blank=True)),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from openstack_auth_shib.logsearch import get_backend
+    with schema_editor.connection.cursor() as cursor:
+        get_backend(schema_editor.connection.vendor).create_index(cursor)
+
+
+def drop_index(apps, schema_editor):
+    from openstack_auth_shib.logsearch import get_backend
+    with schema_editor.connection.cursor() as cursor:
+        get_backend(schema_editor.connection.vendor).drop_index(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openstack_auth_shib', '0003_mailoutbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
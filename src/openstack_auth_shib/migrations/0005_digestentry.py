@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openstack_auth_shib', '0004_log_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False)),
+                ('recipient', models.EmailField(db_index=True, max_length=255)),
+                ('locale', models.CharField(default='en', max_length=8)),
+                ('action', models.CharField(max_length=255)),
+                ('dst_user_id', models.CharField(max_length=64, null=True)),
+                ('dst_project_id', models.CharField(max_length=64, null=True)),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+            ],
+        ),
+    ]
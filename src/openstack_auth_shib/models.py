@@ -13,10 +13,14 @@
 #  License for the specific language governing permissions and limitations
 #  under the License. 
 
+import threading
 from datetime import datetime
 from datetime import timezone as tzone
 
+from django.db import connections
 from django.db import models
+from django.db import router
+from django.db import transaction
 from django.conf import settings
 from django.utils import timezone
 
@@ -85,6 +89,15 @@ RSTATUS_DISABLED = 4
 #
 RSTATUS_REENABLING = 5
 
+#
+# Notification waiting for delivery
+#
+MSTATUS_PENDING = 0
+#
+# Notification discarded after too many delivery attempts
+#
+MSTATUS_FAILED = 1
+
 OS_ID_LEN = 64
 OS_LNAME_LEN = 255
 OS_SNAME_LEN = 64
@@ -272,6 +285,47 @@ class PrjRequest(models.Model):
     notes = models.TextField()
 
 
+#
+# Orphans are registered users without any expiration and without
+# project requests (discarded renewals don't count); the query is
+# evaluated by the database with anti-join subqueries.
+# With with_regrequests the users with a registration request are excluded.
+# With with_pending the users whose project requests are all pending or
+# waiting for the compliance check are orphans too, each item has the
+# "pending" flag set if such a request exists.
+#
+def orphan_registrations(with_regrequests=False, with_pending=False):
+
+    reg_ref = models.OuterRef('regid')
+
+    ignored_status = [ PSTATUS_RENEW_DISC ]
+    if with_pending:
+        ignored_status += [ PSTATUS_PENDING, PSTATUS_CHK_COMP ]
+
+    result = Registration.objects.filter(
+        ~models.Exists(Expiration.objects.filter(registration=reg_ref)),
+        ~models.Exists(PrjRequest.objects.filter(registration=reg_ref)
+                                         .exclude(flowstatus__in=ignored_status))
+    )
+
+    if with_regrequests:
+        result = result.filter(~models.Exists(RegRequest.objects.filter(registration=reg_ref)))
+
+    if with_pending:
+        q_args = {
+            'registration' : reg_ref,
+            'flowstatus__in' : [ PSTATUS_PENDING, PSTATUS_CHK_COMP ]
+        }
+        result = result.annotate(pending=models.Exists(PrjRequest.objects.filter(**q_args)))
+
+    return result
+
+#
+# Audit records of the current thread are collected while a LogBuffer is
+# active and written with bulk inserts
+#
+LOG_BUFFER = threading.local()
+
 class LogManager(models.Manager):
     use_in_migrations = True
 
@@ -281,7 +335,7 @@ class LogManager(models.Manager):
                    dst_project_id=None, dst_user_id=None,
                    extra={}):
 
-        log = self.model.objects.create(
+        log = self.model(
             log_type=log_type,
             action=action,
             message=message,
@@ -293,11 +347,76 @@ class LogManager(models.Manager):
             dst_user_id=dst_user_id,
         )
 
-        for k, v in extra.items():
-            log.logextra_set.create(key=k, value=v)
+        curr_buffer = getattr(LOG_BUFFER, 'buffer', None)
+        if curr_buffer is not None:
+            curr_buffer.add(log, extra)
+            return log
 
+        self.write_bulk([ (log, extra) ])
         return log
 
+    def log_actions_bulk(self, entries, batch_size=500):
+        pairs = list()
+        for entry in entries:
+            entry = entry.copy()
+            extra = entry.pop('extra', {})
+            pairs.append((self.model(**entry), extra))
+        self.write_bulk(pairs, batch_size)
+        return [ x[0] for x in pairs ]
+
+    def write_bulk(self, pairs, batch_size=500):
+        if len(pairs) == 0:
+            return
+
+        db_name = router.db_for_write(self.model)
+        with transaction.atomic(using=db_name):
+            if connections[db_name].features.can_return_rows_from_bulk_insert:
+                self.model.objects.bulk_create([ x[0] for x in pairs ], batch_size=batch_size)
+            else:
+                #
+                # Primary keys are required for the extras
+                #
+                self.model.objects.bulk_create([ x[0] for x in pairs if not x[1] ],
+                                               batch_size=batch_size)
+                for log, extra in pairs:
+                    if extra:
+                        log.save(force_insert=True)
+
+            extra_list = list()
+            for log, extra in pairs:
+                for k, v in extra.items():
+                    extra_list.append(LogExtra(log=log, key=k, value=v))
+            if len(extra_list):
+                LogExtra.objects.bulk_create(extra_list, batch_size=batch_size)
+
+
+class LogBuffer():
+
+    def __init__(self, flush_size=500):
+        self.flush_size = max(flush_size, 1)
+        self.pairs = list()
+        self.prev_buffer = None
+
+    def __enter__(self):
+        self.prev_buffer = getattr(LOG_BUFFER, 'buffer', None)
+        LOG_BUFFER.buffer = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        LOG_BUFFER.buffer = self.prev_buffer
+        self.flush()
+        return False
+
+    def add(self, log, extra):
+        self.pairs.append((log, extra))
+        if len(self.pairs) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        pairs = self.pairs
+        self.pairs = list()
+        Log.objects.write_bulk(pairs, self.flush_size)
+
 
 class Log(models.Model):
     objects = LogManager()
@@ -380,3 +499,54 @@ class LogExtra(models.Model):
     value = models.TextField(
         blank=False,
     )
+
+
+#Temporary data
+class MailOutbox(models.Model):
+    created = models.DateTimeField(
+        default=timezone.now,
+        editable=False
+    )
+    #
+    # Earliest time for the next delivery attempt
+    #
+    next_attempt = models.DateTimeField(
+        default=timezone.now,
+        db_index=True
+    )
+    attempts = models.IntegerField(default=0)
+    #
+    # Delivery status, see MSTATUS_* for possible values
+    #
+    status = models.IntegerField(
+        default=MSTATUS_PENDING,
+        db_index=True
+    )
+    sender = models.CharField(max_length=EMAIL_LEN)
+    #
+    # JSON encoded list of addresses
+    #
+    recipients = models.TextField()
+    reply_to = models.TextField(blank=True)
+    subject = models.TextField()
+    body = models.TextField()
+    last_error = models.TextField(blank=True)
+
+
+#Temporary data
+class DigestEntry(models.Model):
+    created = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        editable=False
+    )
+    recipient = models.EmailField(
+        max_length=EMAIL_LEN,
+        db_index=True
+    )
+    locale = models.CharField(max_length=8, default='en')
+    action = models.CharField(max_length=255)
+    dst_user_id = models.CharField(max_length=OS_ID_LEN, null=True)
+    dst_project_id = models.CharField(max_length=OS_ID_LEN, null=True)
+    subject = models.TextField()
+    body = models.TextField()
@@ -18,23 +18,31 @@ import os, os.path
 import re
 import json
 import threading
+import time
+from datetime import timedelta
 from configparser import ConfigParser
 from configparser import ExtendedInterpolation
 
 from django.conf import settings
 from django.core.mail import EmailMessage
+from django.core.mail import get_connection
+from django.db import router
+from django.db import transaction
 from django.template import Template as DjangoTemplate
 from django.template import Context as DjangoContext
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from horizon import messages as MESSAGES
 
 from .models import Log
+from .models import MailOutbox
+from .models import DigestEntry
+from .models import MSTATUS_PENDING
+from .models import MSTATUS_FAILED
 
 
 LOG = logging.getLogger(__name__)
 
-TEMPLATE_TABLE = dict()
-TEMPLATE_LOCK = threading.Lock()
 TEMPLATE_REGEX = re.compile(r'notifications_(\w\w).txt$')
 
 # List of available notification templates
@@ -69,6 +77,7 @@ DEL_USERS_SUMMARY = 'deleted_users_summary'
 COMP_CHECK_TYPE = 'compliance_check'
 PROMO_AVAIL = 'proposed_promotion'
 PROMO_REJECTED = 'promotion_rejected'
+NOTIFICATION_DIGEST = 'notification_digest'
 
 # DO NOT CHANGE the LOG_TYPE_* constants
 LOG_TYPE_EMAIL = '__EMAIL__'
@@ -76,6 +85,12 @@ LOG_TYPE_EMAIL = '__EMAIL__'
 
 MANAGERS_RCPT = '__MANAGERS__'
 
+#
+# Notifications of these types are collected per recipient and sent
+# as a single summary by the senddigest command
+#
+DIGEST_ACTIONS = getattr(settings, 'NOTIFICATION_DIGEST_ACTIONS', [])
+
 
 class NotificationTemplate():
 
@@ -163,6 +178,9 @@ def _log_notify(rcpt, action, context, locale='en', request=None,
 
     if rcpt == MANAGERS_RCPT:
         notifyManagers(subject, body)
+    elif action in DIGEST_ACTIONS:
+        add_to_digest(rcpt, action, subject, body, locale,
+                      dst_user_id=dst_user_id, dst_project_id=dst_project_id)
     else:
         notify(rcpt, subject, body)
 
@@ -202,53 +220,217 @@ def notifyAdmin(action, context, locale='en', *args, **kwargs):
     _log_notify(MANAGERS_RCPT, action, context, locale, **kwargs)
 
 
-def notification_render(msg_type, ctx_dict, locale='en'):
-
-    load_templates()
-    
-    notify_tpl = TEMPLATE_TABLE[locale].get(msg_type, None)
-    if notify_tpl:
-        return notify_tpl.render(ctx_dict)
-    return (None, None, None)
-
-def load_templates():
-
-    TEMPLATE_LOCK.acquire()
-    
-    if len(TEMPLATE_TABLE):
-        TEMPLATE_LOCK.release()
-        return
-
-    LOG.debug('Filling in the template table')
-    tpl_dir = getattr(settings, 'NOTIFICATION_TEMPLATE_DIR', '/usr/share/openstack-auth-shib/templates')
-    
-    try:
-        for tpl_item in os.listdir(tpl_dir):
+#
+# The template table is compiled once and replaced as a whole when the
+# files in NOTIFICATION_TEMPLATE_DIR change, readers never take the lock.
+# The directory is checked at most every TEMPLATE_CHECK_INTERVAL seconds.
+#
+try:
+    TEMPLATE_CHECK_INTERVAL = float(getattr(settings, 'NOTIFICATION_TEMPLATE_CHECK_INTERVAL', '30'))
+except:
+    TEMPLATE_CHECK_INTERVAL = 30.0
+
+class TemplateRegistry():
+
+    def __init__(self, check_interval=TEMPLATE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.table = None
+        self.files_key = None
+        self.last_check = 0.0
+
+    def get_dir(self):
+        return getattr(settings, 'NOTIFICATION_TEMPLATE_DIR', '/usr/share/openstack-auth-shib/templates')
+
+    def _scan(self, tpl_dir):
+        result = list()
+        for tpl_item in sorted(os.listdir(tpl_dir)):
             res_match = TEMPLATE_REGEX.search(tpl_item)
             if not res_match:
                 continue
-            
-            locale = res_match.group(1).lower()
-            TEMPLATE_TABLE[locale] = dict()
-        
             tpl_filename = os.path.join(tpl_dir, tpl_item)
+            f_stat = os.stat(tpl_filename)
+            result.append((tpl_filename, res_match.group(1).lower(),
+                           f_stat.st_mtime_ns, f_stat.st_size))
+        return tuple(result)
+
+    def _compile(self, files_key):
+        new_table = dict()
+        for tpl_filename, locale, f_mtime, f_size in files_key:
+            new_table[locale] = dict()
+
             parser = ConfigParser(interpolation=ExtendedInterpolation())
             parser.read(tpl_filename)
-        
+
             for sect in parser.sections():
-            
+
                 sbj = parser.get(sect, 'subject') if parser.has_option(sect, 'subject') else "No subject"
                 body = parser.get(sect, 'body') if parser.has_option(sect, 'body') else "No body"
                 log_tpl = parser.get(sect, 'LOG') if parser.has_option(sect, 'LOG') else "No log"
-                TEMPLATE_TABLE[locale][sect] = NotificationTemplate(sbj, body, log_tpl)
-        
-    except:
-        #
-        # TODO need cleanup??
-        #
-        LOG.error("Cannot load template table", exc_info=True)
+                new_table[locale][sect] = NotificationTemplate(sbj, body, log_tpl)
+        return new_table
+
+    def refresh(self, force=False):
+
+        if not self.lock.acquire(blocking = force or self.table is None):
+            # another thread is refreshing, the current table is still valid
+            return self.table
+
+        try:
+            now = time.monotonic()
+            if not force and self.table is not None and now - self.last_check < self.check_interval:
+                return self.table
+            self.last_check = now
+
+            files_key = self._scan(self.get_dir())
+            if force or files_key != self.files_key:
+                LOG.debug('Filling in the template table')
+                self.table = self._compile(files_key)
+                self.files_key = files_key
+        except:
+            LOG.error("Cannot load template table", exc_info=True)
+            if self.table is None:
+                self.table = dict()
+        finally:
+            self.lock.release()
+
+        return self.table
+
+    def get_table(self):
+        table = self.table
+        if table is None or time.monotonic() - self.last_check >= self.check_interval:
+            table = self.refresh()
+        return table
+
+TEMPLATE_REGISTRY = TemplateRegistry()
+
+if getattr(settings, 'NOTIFICATION_TEMPLATE_PRELOAD', False):
+    TEMPLATE_REGISTRY.refresh(force=True)
+
+def notification_render(msg_type, ctx_dict, locale='en'):
+
+    notify_tpl = TEMPLATE_REGISTRY.get_table().get(locale, {}).get(msg_type, None)
+    if notify_tpl:
+        return notify_tpl.render(ctx_dict)
+    return (None, None, None)
+
+def load_templates():
+    return TEMPLATE_REGISTRY.refresh(force=True)
+
+#
+# Notifications are stored in the outbox and delivered by the sendoutbox
+# command, so that the request latency does not depend on the mail relay
+#
+USE_OUTBOX = getattr(settings, 'NOTIFICATION_USE_OUTBOX', True)
+
+def _message_args(recpt, subject, body):
+    m_args = {
+        "subject" : subject,
+        "body" : body,
+        "from_email" : settings.SERVER_EMAIL,
+        "to" : recpt if isinstance(recpt, list) else [ str(recpt) ]
+    }
 
-    TEMPLATE_LOCK.release()
+    replyto = getattr(settings, 'REPLYTO', None)
+    if replyto:
+        m_args["reply_to"] = replyto if isinstance(replyto, list) else [ str(replyto) ]
+    return m_args
+
+def enqueue(m_args):
+    MailOutbox.objects.create(
+        sender = m_args['from_email'],
+        recipients = json.dumps(m_args['to']),
+        reply_to = json.dumps(m_args.get('reply_to', [])),
+        subject = m_args['subject'],
+        body = m_args['body']
+    )
+
+#
+# Batch delivery for the cron scripts: while the context is active the
+# notifications of the current thread are collected and sent with one
+# connection per batch, throttled to NOTIFICATION_RATE messages per second
+#
+try:
+    BATCH_SIZE = int(getattr(settings, 'NOTIFICATION_BATCH_SIZE', '50'))
+except:
+    BATCH_SIZE = 50
+
+try:
+    BATCH_RATE = float(getattr(settings, 'NOTIFICATION_RATE', '0'))
+except:
+    BATCH_RATE = 0.0
+
+BATCH_LOCAL = threading.local()
+
+class NotificationBatch():
+
+    def __init__(self, batch_size=BATCH_SIZE, rate=BATCH_RATE):
+        self.batch_size = max(batch_size, 1)
+        self.rate = rate
+        self.messages = list()
+        self.n_sent = 0
+        self.n_failed = 0
+        self.prev_batch = None
+
+    def __enter__(self):
+        self.prev_batch = getattr(BATCH_LOCAL, 'batch', None)
+        BATCH_LOCAL.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        BATCH_LOCAL.batch = self.prev_batch
+        self.flush()
+        LOG.debug("Batch delivery: %d sent, %d failed" % (self.n_sent, self.n_failed))
+        return False
+
+    def add(self, m_args):
+        self.messages.append(m_args)
+        if len(self.messages) >= self.batch_size:
+            self.flush()
+
+    def _throttle(self, t_start, n_msgs):
+        if self.rate > 0:
+            delay = n_msgs / self.rate - (time.monotonic() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def flush(self):
+        while len(self.messages):
+            chunk = self.messages[:self.batch_size]
+            self.messages = self.messages[self.batch_size:]
+
+            #
+            # Messages are sent one at a time over the same connection so that
+            # only the ones not delivered are queued again after a failure.
+            #
+            t_start = time.monotonic()
+            unsent = list()
+            connection = None
+            try:
+                connection = get_connection()
+                connection.open()
+                for m_args in chunk:
+                    try:
+                        connection.send_messages([ EmailMessage(connection=connection, **m_args) ])
+                        self.n_sent += 1
+                    except:
+                        LOG.error("Cannot send notification", exc_info=True)
+                        unsent.append(m_args)
+            except:
+                LOG.error("Cannot open the mail connection", exc_info=True)
+                unsent = chunk
+            finally:
+                if connection:
+                    connection.close()
+
+            self.n_failed += len(unsent)
+            if USE_OUTBOX:
+                for m_args in unsent:
+                    try:
+                        enqueue(m_args)
+                    except:
+                        LOG.error("Cannot queue notification", exc_info=True)
+            self._throttle(t_start, len(chunk))
 
 def notify(recpt, subject, body):
     
@@ -257,22 +439,157 @@ def notify(recpt, subject, body):
         return
     
     try:
-        m_args = {
-            "subject" : subject,
-            "body" : body,
-            "from_email" : settings.SERVER_EMAIL,
-            "to" : recpt if isinstance(recpt, list) else [ str(recpt) ]
-        }
-
-        replyto = getattr(settings, 'REPLYTO', None)
-        if replyto:
-            m_args["reply_to"] = replyto if isinstance(replyto, list) else [ str(replyto) ]
+        m_args = _message_args(recpt, subject, body)
+
+        curr_batch = getattr(BATCH_LOCAL, 'batch', None)
+        if curr_batch:
+            curr_batch.add(m_args)
+            LOG.debug("Batched %s - %s - to %s" % (subject, body, str(recpt)))
+            return
+
+        if USE_OUTBOX:
+            try:
+                enqueue(m_args)
+                LOG.debug("Queued %s - %s - to %s" % (subject, body, str(recpt)))
+                return
+            except:
+                LOG.error("Cannot queue notification, sending now", exc_info=True)
 
         EmailMessage(**m_args).send()
         LOG.debug("Sending %s - %s - to %s" % (subject, body, str(recpt)))
     except:
         LOG.error("Cannot send notification", exc_info=True)
 
+#
+# Each batch is claimed before sending: the rows are locked (rows locked by
+# other workers are skipped) and their next_attempt is moved forward by
+# "lease" seconds, so that concurrent runs (cron, cloudvenetod, --loop)
+# don't send the same messages; if the worker dies the lease expires and
+# the rows are sent again.
+#
+def claim_outbox(batch_size=100, lease=600):
+
+    now = timezone.now()
+    q_args = {
+        'status' : MSTATUS_PENDING,
+        'next_attempt__lte' : now
+    }
+
+    with transaction.atomic(using=router.db_for_write(MailOutbox)):
+        q_set = MailOutbox.objects.select_for_update(skip_locked=True)
+        c_ids = list(q_set.filter(**q_args).order_by('id').values_list('id', flat=True)[:batch_size])
+        if len(c_ids) == 0:
+            return list()
+
+        lease_end = now + timedelta(seconds=lease)
+        MailOutbox.objects.filter(id__in = c_ids, **q_args).update(next_attempt = lease_end)
+
+    return list(MailOutbox.objects.filter(id__in = c_ids, next_attempt = lease_end).order_by('id'))
+
+def send_outbox(batch_size=100, max_attempts=10, backoff=60, max_backoff=86400, lease=600):
+
+    n_sent = 0
+    n_failed = 0
+
+    out_list = claim_outbox(batch_size, lease)
+    if len(out_list) == 0:
+        return (n_sent, n_failed)
+
+    delivered = list()
+    connection = get_connection()
+    try:
+        connection.open()
+        for out_item in out_list:
+            try:
+                e_msg = EmailMessage(
+                    subject = out_item.subject,
+                    body = out_item.body,
+                    from_email = out_item.sender,
+                    to = json.loads(out_item.recipients),
+                    reply_to = json.loads(out_item.reply_to) if out_item.reply_to else None,
+                    connection = connection
+                )
+                connection.send_messages([ e_msg ])
+                delivered.append(out_item.id)
+                n_sent += 1
+            except Exception as exc:
+                LOG.error("Cannot send notification %d" % out_item.id, exc_info=True)
+                n_failed += 1
+                out_item.attempts += 1
+                out_item.last_error = str(exc)
+                if out_item.attempts >= max_attempts:
+                    out_item.status = MSTATUS_FAILED
+                else:
+                    delay = min(backoff * 2 ** (out_item.attempts - 1), max_backoff)
+                    out_item.next_attempt = timezone.now() + timedelta(seconds=delay)
+                out_item.save()
+    finally:
+        connection.close()
+        MailOutbox.objects.filter(id__in = delivered).delete()
+
+    return (n_sent, n_failed)
+
+def add_to_digest(recpt, action, subject, body, locale='en',
+                  dst_user_id=None, dst_project_id=None):
+
+    if not recpt:
+        LOG.error('Missing recipients')
+        return
+
+    try:
+        for r_item in (recpt if isinstance(recpt, list) else [ recpt ]):
+            DigestEntry.objects.create(
+                recipient = str(r_item),
+                locale = locale,
+                action = action,
+                dst_user_id = dst_user_id,
+                dst_project_id = dst_project_id,
+                subject = subject,
+                body = body
+            )
+    except:
+        LOG.error("Cannot add notification to digest, sending now", exc_info=True)
+        notify(recpt, subject, body)
+
+#
+# The entries of each recipient are claimed in their own transaction: the
+# rows are locked (rows locked by another sender are skipped) and deleted
+# in the same transaction that renders and queues the digest, so a run
+# overlapping with another one never sends the same entry twice.
+#
+def send_digests(window=60):
+
+    n_digests = 0
+    limit = timezone.now() - timedelta(minutes=window)
+
+    r_list = DigestEntry.objects.filter(created__lte = limit) \
+                                .values_list('recipient', flat = True).distinct()
+
+    for recipient in list(r_list):
+
+        with transaction.atomic(using=router.db_for_write(DigestEntry)):
+            q_set = DigestEntry.objects.select_for_update(skip_locked=True)
+            e_list = list(q_set.filter(recipient = recipient).order_by('id'))
+            if len(e_list) == 0:
+                continue
+
+            by_locale = dict()
+            for e_item in e_list:
+                by_locale.setdefault(e_item.locale, list()).append(e_item)
+
+            for locale, l_list in by_locale.items():
+                noti_params = {
+                    'count' : len(l_list),
+                    'items' : [ (x.subject, x.body.strip().split('\n')[0]) for x in l_list ]
+                }
+                dst_users = set(x.dst_user_id for x in l_list if x.dst_user_id)
+                notifyUser(recipient, NOTIFICATION_DIGEST, noti_params, locale,
+                           dst_user_id = dst_users.pop() if len(dst_users) == 1 else None)
+                n_digests += 1
+
+            DigestEntry.objects.filter(id__in = [ x.id for x in e_list ]).delete()
+
+    return n_digests
 
 def notifyManagers(subject, body):
 
@@ -17,7 +17,10 @@ import logging
 import re
 import os
 import os.path
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timezone
 from datetime import timedelta
@@ -617,21 +620,101 @@ def unique_admin(username, prjname):
 #
 # Workaround for unit_table reloading at runtime
 #
-def get_unit_table():
+# The unit table script is compiled and executed only when the file changes,
+# the result is cached per process and keyed on (path, mtime, size).
+# The file is checked with a stat() call at most every UNIT_TABLE_CHECK_INTERVAL
+# seconds, so that hot-reload still works without the exec cost on each request.
+#
+try:
+    UNIT_TABLE_CHECK_INTERVAL = float(getattr(settings, 'UNIT_TABLE_CHECK_INTERVAL', '10'))
+except:
+    UNIT_TABLE_CHECK_INTERVAL = 10.0
 
-    unit_filename = os.environ.get("CLOUDVENETO_UNITTABLE", 
-                                   "/etc/openstack-dashboard/unit_table.py")
-    try:
+class UnitTableLoader:
 
-        if os.path.exists(unit_filename):
-            with open(unit_filename) as f:
-                exec(f.read())
-            return UNIT_TABLE
+    def __init__(self, check_interval = UNIT_TABLE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.cache_key = None
+        self.table = None
+        self.last_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
 
-    except Exception:
-        LOG.error("Cannot exec unit table script", exc_info=True)
+    def get_filename(self):
+        return os.environ.get("CLOUDVENETO_UNITTABLE",
+                              "/etc/openstack-dashboard/unit_table.py")
+
+    def get_stats(self):
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'reloads' : self.reloads,
+            'key' : self.cache_key
+        }
+
+    def invalidate(self):
+        with self.lock:
+            self.cache_key = None
+            self.table = None
+            self.last_check = 0.0
+
+    def _compile_table(self, unit_filename):
+        with open(unit_filename) as f:
+            code = compile(f.read(), unit_filename, 'exec')
+        namespace = dict()
+        exec(code, namespace)
+        return namespace['UNIT_TABLE']
+
+    def load(self):
+
+        now = time.monotonic()
+        table = self.table
+        if table is not None and now - self.last_check < self.check_interval:
+            self.hits += 1
+            return table
+
+        with self.lock:
+
+            unit_filename = self.get_filename()
+            try:
+                f_stat = os.stat(unit_filename)
+                new_key = (unit_filename, f_stat.st_mtime_ns, f_stat.st_size)
+            except FileNotFoundError:
+                new_key = None
+            except Exception:
+                LOG.error("Cannot stat unit table script", exc_info=True)
+                new_key = None
+
+            self.last_check = now
+
+            if new_key == self.cache_key and self.table is not None:
+                self.hits += 1
+                return self.table
+
+            self.misses += 1
+            new_table = getattr(settings, 'UNIT_TABLE', {})
+
+            if new_key is not None:
+                try:
+                    new_table = self._compile_table(unit_filename)
+                    self.reloads += 1
+                    LOG.info("Loaded unit table from %s" % unit_filename)
+                except Exception:
+                    #
+                    # The broken script is not executed again until it changes
+                    #
+                    LOG.error("Cannot exec unit table script", exc_info=True)
 
-    return getattr(settings, 'UNIT_TABLE', {})
+            self.cache_key = new_key
+            self.table = new_table
+            return new_table
+
+UNIT_TABLE_LOADER = UnitTableLoader()
+
+def get_unit_table():
+    return UNIT_TABLE_LOADER.load()
 
 
 class AAIDBRouter:
@@ -661,8 +744,8 @@ class AAIDBRouter:
         return None
 
 
-def getProjectInfo(request, project):
-    result = {
+def _empty_project_info(project):
+    return {
         'name' : project.projectname,
         'descr' : project.description,
         'comp_required' : False,
@@ -673,58 +756,100 @@ def getProjectInfo(request, project):
         'dept_man' : ''
     }
 
+def _apply_prj_attribute(result, attr, comp_rules):
+
+    if attr.name == ATT_PRJ_ORG:
+        result['org'] = attr.value
+        for o_item in comp_rules.get('organizations', []):
+            if o_item == attr.value:
+                result['comp_required'] = True
+
+    elif attr.name == ATT_PRJ_OU:
+        result['ou'] = attr.value
+
+    elif attr.name == ATT_PRJ_CPER:
+        result['contactper'] = attr.value
+
+    elif attr.name == ATT_PRJ_CIDR:
+        for n_item in comp_rules.get('subnets', []):
+            if attr.value.startswith(n_item):
+                result['comp_required'] = True
+
+    elif attr.name == ATT_PRJ_EXP:
+        result['exp_date'] = datetime.fromisoformat(attr.value)
+
+def _apply_dept_manager(result):
+    if result['org'] and result['ou']:
+        o_data = settings.HORIZON_CONFIG.get('organization', {}).get(result['org'], [])
+        for ou_tuple in o_data:
+            if len(ou_tuple) > 4 and ou_tuple[0] == result['ou']:
+                result['dept_man'] = "(%s) %s <%s>" % ou_tuple[1 : 4]
+
+def getProjectInfo(request, project):
+    return getProjectInfoMany(request, [ project ])[project.projectname]
+
+#
+# Information for a list of projects with a constant number of round trips:
+# one query for all the attributes or, in the legacy model, one tag filtered
+# project listing and one subnet listing, executed concurrently.
+# The result is a dictionary indexed by project name
+#
+def getProjectInfoMany(request, projects):
+
+    result = dict((prj.projectname, _empty_project_info(prj)) for prj in projects)
+
     comp_rules = getattr(settings, 'COMPLIANCE_RULES', None)
-    if not comp_rules:
+    if not comp_rules or not result:
         return result
 
     if NEW_MODEL:
         # no transactions here
-        for attr in PrjAttribute.objects.filter(project = project):
+        for attr in PrjAttribute.objects.filter(project__in = list(result.keys())):
+            _apply_prj_attribute(result[attr.project_id], attr, comp_rules)
 
-            if attr.name == ATT_PRJ_ORG:
-                result['org'] = attr.value
-                for o_item in comp_rules.get('organizations', []):
-                    if o_item == attr.value:
-                        result['comp_required'] = True
+        for prj_info in result.values():
+            _apply_dept_manager(prj_info)
+        return result
 
-            elif attr.name == ATT_PRJ_OU:
-                result['ou'] = attr.value
+    prj_table = dict((prj.projectid, prj.projectname) for prj in projects if prj.projectid)
+    if not prj_table:
+        return result
 
-            elif attr.name == ATT_PRJ_CPER:
-                result['contactper'] = attr.value
+    def _get_tagged_projects():
+        org_tags = [ 'O=' + x for x in comp_rules.get('organizations', []) ]
+        if not org_tags:
+            return []
+        kprj_man = keystone_api.keystoneclient(request).projects
+        return [ x.id for x in kprj_man.list(tags_any = org_tags) ]
 
-            elif attr.name == ATT_PRJ_CIDR:
-                for n_item in comp_rules.get('subnets', []):
-                    if attr.value.startswith(n_item):
-                        result['comp_required'] = True
+    def _get_subnets():
+        return neutron_api.subnet_list(request, project_id = list(prj_table.keys()))
 
-            elif attr.name == ATT_PRJ_EXP:
-                result['exp_date'] = datetime.fromisoformat(attr.value)
-
-        if result['org'] and result['ou']:
-            o_data = settings.HORIZON_CONFIG.get('organization', {}).get(result['org'], [])
-            for ou_tuple in o_data:
-                if len(ou_tuple) > 4 and ou_tuple[0] == result['ou']:
-                    result['dept_man'] = "(%s) %s <%s>" % ou_tuple[1 : 4]
-        return result
+    with ThreadPoolExecutor(max_workers = 2) as executor:
+        tag_future = executor.submit(_get_tagged_projects)
+        net_future = executor.submit(_get_subnets)
 
     try:
-        kprj_man = keystone_api.keystoneclient(request).projects
-        for item in comp_rules.get('organizations', []):
-            if ('O=' + item) in kprj_man.list_tags(project.projectid):
-                result['comp_required'] = True
+        for prj_id in tag_future.result():
+            if prj_id in prj_table:
+                result[prj_table[prj_id]]['comp_required'] = True
     except:
         LOG.error("Registration error", exc_info=True)
-        result['err_msg'] = _("Cannot retrieve organization tag")
+        for prj_info in result.values():
+            prj_info['err_msg'] = _("Cannot retrieve organization tag")
 
     try:
-        for s_item in neutron_api.subnet_list(request, project_id = project.projectid):
+        for s_item in net_future.result():
+            prjname = prj_table.get(s_item.project_id, None)
+            if not prjname:
+                continue
             for p_item in comp_rules.get('subnets', []):
                 if p_item in s_item.cidr:
-                    result['comp_required'] = True
+                    result[prjname]['comp_required'] = True
     except:
         LOG.error("Registration error", exc_info=True)
-        result['err_msg'] = _("Cannot retrieve subnetwork")
+        for prj_info in result.values():
+            prj_info['err_msg'] = _("Cannot retrieve subnetwork")
 
     return result
 
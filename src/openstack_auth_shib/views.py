@@ -53,6 +53,9 @@ from .models import PRJ_COURSE
 from .forms import RegistrForm
 from .idpmanager import Federated_Account
 from .idpmanager import checkFederationSetup
+from .idpmanager import FEDERATION_BUSY
+from .idpmanager import FEDERATION_RECONCILED
+from .idpmanager import FEDERATION_FAILED
 
 from .models import NEW_MODEL
 if NEW_MODEL:
@@ -80,7 +83,13 @@ def login(request):
 
     result = basic_login(request)
     if request.user.is_authenticated and request.user.is_superuser:
-        checkFederationSetup(request)
+        fed_result = checkFederationSetup(request)
+        if fed_result == FEDERATION_FAILED:
+            LOG.error("Federation setup check failed, run the checkfederation command")
+        elif fed_result == FEDERATION_BUSY:
+            LOG.info("Federation setup check skipped, another worker is running it")
+        elif fed_result == FEDERATION_RECONCILED:
+            LOG.info("Federation setup reconciled with the WEBSSO_IDP_* settings")
     return result
 
 @sensitive_post_parameters()
@@ -37,6 +37,7 @@ from openstack_auth_shib.models import RegRequest
 from openstack_auth_shib.models import Expiration
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import PrjRole
+from openstack_auth_shib.models import LogBuffer
 from openstack_auth_shib.models import PRJ_PUBLIC
 from openstack_auth_shib.models import RSTATUS_REMINDER
 from openstack_auth_shib.models import RSTATUS_REMINDACK
@@ -226,23 +227,24 @@ class ExtCreateProject(baseWorkflows.CreateProject):
 
             result = super(ExtCreateProject, self)._update_project_members(request, data, project_id)
 
-        #
-        # Notify users
-        #
-        for e_item in EMail.objects.filter(registration__userid__in=member_ids):
-            noti_params = {
-                'username' : e_item.registration.username,
-                'project' : self.this_project.projectname,
-                'isadmin' : e_item.registration.userid in prjadm_ids
-            }
-            notifyUser(request=request, rcpt=e_item.email, action=MEMBER_FORCED_ADD, context=noti_params,
-                       dst_project_id=self.this_project.projectid, dst_user_id=e_item.registration.userid)
+        with LogBuffer():
+            #
+            # Notify users
+            #
+            for e_item in EMail.objects.filter(registration__userid__in=member_ids):
+                noti_params = {
+                    'username' : e_item.registration.username,
+                    'project' : self.this_project.projectname,
+                    'isadmin' : e_item.registration.userid in prjadm_ids
+                }
+                notifyUser(request=request, rcpt=e_item.email, action=MEMBER_FORCED_ADD, context=noti_params,
+                           dst_project_id=self.this_project.projectid, dst_user_id=e_item.registration.userid)
 
-        #
-        # Notify all cloud admins
-        #
-        notifyAdmin(request=request, action=NEWPRJ_BY_ADM,
-                    context={'project' : self.this_project.projectname})        
+            #
+            # Notify all cloud admins
+            #
+            notifyAdmin(request=request, action=NEWPRJ_BY_ADM,
+                        context={'project' : self.this_project.projectname})
 
         return result
 
@@ -410,22 +412,23 @@ class ExtUpdateProject(baseWorkflows.UpdateProject):
         #
         # Notify users, both new and removed
         #
-        for e_item in rm_email_list:
-            noti_params = {
-                'username' : e_item.registration.username,
-                'project' : self.this_project.projectname
-            }
-            notifyUser(request=request, rcpt=e_item.email, action=MEMBER_FORCED_RM, context=noti_params,
-                       dst_project_id=self.this_project.projectid, dst_user_id=e_item.registration.userid)
-
-        for e_item in add_email_list:
-            noti_params = {
-                'username' : e_item.registration.username,
-                'project' : self.this_project.projectname,
-                'isadmin' : e_item.registration.userid in prjadm_ids
-            }
-            notifyUser(request=request, rcpt=e_item.email, action=MEMBER_FORCED_ADD, context=noti_params,
-                       dst_project_id=self.this_project.projectid, dst_user_id=e_item.registration.userid)
+        with LogBuffer():
+            for e_item in rm_email_list:
+                noti_params = {
+                    'username' : e_item.registration.username,
+                    'project' : self.this_project.projectname
+                }
+                notifyUser(request=request, rcpt=e_item.email, action=MEMBER_FORCED_RM, context=noti_params,
+                           dst_project_id=self.this_project.projectid, dst_user_id=e_item.registration.userid)
+
+            for e_item in add_email_list:
+                noti_params = {
+                    'username' : e_item.registration.username,
+                    'project' : self.this_project.projectname,
+                    'isadmin' : e_item.registration.userid in prjadm_ids
+                }
+                notifyUser(request=request, rcpt=e_item.email, action=MEMBER_FORCED_ADD, context=noti_params,
+                           dst_project_id=self.this_project.projectid, dst_user_id=e_item.registration.userid)
 
         if len(prjadm_ids) == 0:
             messages.warning(request, _("Missing project admin for this project"))
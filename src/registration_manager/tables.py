@@ -151,6 +151,16 @@ class RejectPromotionLink(tables.LinkAction):
     def allowed(self, request, datum):
         return datum.code == RegistrData.PRO_ADMIN
 
+class RegFilterAction(tables.FilterAction):
+    name = "reg_filter"
+
+    filter_type = "server"
+
+    filter_choices = (
+        ("code", _("Request type (code or text)"), True),
+        ("username", _("User name ="), True),
+    )
+
 class OperationTable(tables.DataTable):
     username = tables.Column('username', verbose_name=_('User name'))
     fullname = tables.Column('fullname', verbose_name=_('Full name'))
@@ -161,6 +171,9 @@ class OperationTable(tables.DataTable):
     class Meta:
         name = "operation_table"
         verbose_name = _("Pending requests")
+        table_actions = (RegFilterAction,)
+        pagination_param = "reg_marker"
+        prev_pagination_param = "prev_reg_marker"
         row_actions = (PreCheckLink,
                        ChkCompAck,
                        PromoteAdminLink,
@@ -20,15 +20,24 @@ from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse_lazy as reverse
 from django.db import transaction
+from django.db.models import Count
+from django.db.models import Exists
+from django.db.models import IntegerField
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models.functions import Lower
 
 from horizon import tables
 from horizon import exceptions
 from horizon import forms
 
+from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import RegRequest
 from openstack_auth_shib.models import PrjRequest
 from openstack_auth_shib.models import EMail
 from openstack_auth_shib.models import Expiration
+from openstack_auth_shib.models import PrjRole
 from openstack_auth_shib.models import NEW_MODEL
 if NEW_MODEL:
     from openstack_auth_shib.models import PrjAttribute
@@ -41,8 +50,7 @@ from openstack_auth_shib.models import PSTATUS_RENEW_ATTEMPT
 from openstack_auth_shib.models import PSTATUS_RENEW_DISC
 from openstack_auth_shib.models import PSTATUS_CHK_COMP
 from openstack_auth_shib.models import PSTATUS_ADM_ELECT
-from openstack_auth_shib.utils import unique_admin
-from openstack_auth_shib.utils import getProjectInfo
+from openstack_auth_shib.utils import getProjectInfoMany
 from openstack_auth_shib.utils import parse_requestid
 from openstack_auth_shib.utils import ATT_PRJ_EXP
 
@@ -64,30 +72,133 @@ from .forms import RejectPromotionForm
 
 LOG = logging.getLogger(__name__)
 
-class MainView(tables.DataTableView):
+#
+# Request codes for the project requests in advanced status
+#
+PRJREQ_STATUS_CODES = {
+    PSTATUS_CHK_COMP : RegistrData.CHK_COMP,
+    PSTATUS_ADM_ELECT : RegistrData.PRO_ADMIN,
+    PSTATUS_RENEW_ATTEMPT : RegistrData.REN_ATTEMPT,
+    PSTATUS_RENEW_DISC : RegistrData.REN_DISC,
+    PSTATUS_RENEW_MEMB : RegistrData.USR_RENEW,
+    PSTATUS_RENEW_ADMIN : RegistrData.PRJADM_RENEW
+}
+
+def parse_code_filter(f_str):
+    f_str = f_str.strip().lower()
+    if f_str.isdigit():
+        return set([ int(f_str) ])
+    return set(idx for idx, descr in enumerate(RegistrData.DESCRARRAY)
+               if idx > 0 and f_str in str(descr).lower())
+
+def code_query(codes):
+    result = Q(pk__in = [])
+    for p_status, p_code in PRJREQ_STATUS_CODES.items():
+        if p_code in codes:
+            result |= Q(flowstatus = p_status)
+
+    new_req = Q(flowstatus__lt = PSTATUS_CHK_COMP)
+    if RegistrData.NEW_USR_EX_PRJ in codes:
+        result |= new_req & Q(project__projectid__isnull = False, reg_pending = True)
+    if RegistrData.EX_USR_EX_PRJ in codes:
+        result |= new_req & Q(project__projectid__isnull = False, reg_pending = False)
+    if RegistrData.NEW_USR_NEW_PRJ in codes:
+        result |= new_req & Q(project__projectid__isnull = True, reg_pending = True)
+    if RegistrData.EX_USR_NEW_PRJ in codes:
+        result |= new_req & Q(project__projectid__isnull = True, reg_pending = False)
+    return result
+
+class MainView(tables.PagedTableMixin, tables.DataTableView):
     table_class = OperationTable
     template_name = 'idmanager/registration_manager/reg_manager.html'
     page_title = _("Registrations")
 
+    def get_page_size(self):
+        return getattr(settings, 'REGISTRATION_MANAGER_PAGE_SIZE', 100)
+
+    def get_marker_key(self, marker):
+        # The marker is the request id of the last (or first) row of the page,
+        # the rows are sorted by (lowercase username, regid, projectname):
+        # the same key is used in the queries and in the merge of the two sources
+        try:
+            regid, prjname = parse_requestid(marker)
+            q_args = { 'regid' : regid }
+            m_user = Registration.objects.filter(**q_args).values_list('username', flat=True).first()
+        except Exception:
+            m_user = None
+        if m_user is None:
+            return None
+        return (m_user.lower(), regid, prjname if prjname else '')
+
+    def get_keyset(self, queryset, m_key, sort_dir, p_field):
+        queryset = queryset.annotate(u_lower = Lower('registration__username'))
+        order = [ 'u_lower', 'registration_id' ] + ([ p_field ] if p_field else [])
+        if m_key is None:
+            return queryset.order_by(*order)
+
+        m_user, m_regid, m_prj = m_key
+        if sort_dir == 'asc':
+            q_key = Q(u_lower__lt = m_user) | Q(u_lower = m_user, registration_id__lt = m_regid)
+            if p_field:
+                q_key |= Q(**{ 'u_lower' : m_user, 'registration_id' : m_regid, p_field + '__lt' : m_prj })
+            elif m_prj:
+                q_key |= Q(u_lower = m_user, registration_id = m_regid)
+            return queryset.filter(q_key).order_by(*[ '-' + x for x in order ])
+
+        q_key = Q(u_lower__gt = m_user) | Q(u_lower = m_user, registration_id__gt = m_regid)
+        if p_field:
+            q_key |= Q(**{ 'u_lower' : m_user, 'registration_id' : m_regid, p_field + '__gt' : m_prj })
+        return queryset.filter(q_key).order_by(*order)
+
     def get_data(self):
-    
-        reqTable = dict()
+
+        filters = self.get_filters()
+        codes = parse_code_filter(filters['code']) if 'code' in filters else None
+        f_user = filters.get('username', None)
+
+        marker, sort_dir = self._get_marker()
+        page_size = self.get_page_size()
+
+        result = list()
         with transaction.atomic():
-        
-            regid_pending = set()
-            for tmpRegReq in RegRequest.objects.filter(flowstatus=RSTATUS_PENDING):
-                regid_pending.add(tmpRegReq.registration.regid)
 
-            for tmpRegReq in RegRequest.objects.filter(flowstatus=RSTATUS_REMINDACK):
-                req_id = "%d:" % tmpRegReq.registration.regid
-                rData = RegistrData(
-                    registration = tmpRegReq.registration,
-                    requestid = req_id,
-                    code = RegistrData.REMINDER
-                )
-                reqTable[req_id] = rData
+            m_key = self.get_marker_key(marker) if marker else None
 
-            for prjReq in PrjRequest.objects.all():
+            if codes is None or RegistrData.REMINDER in codes:
+                rem_set = RegRequest.objects.filter(flowstatus=RSTATUS_REMINDACK)
+                if f_user:
+                    rem_set = rem_set.filter(registration__username=f_user)
+                rem_set = self.get_keyset(rem_set.select_related('registration'),
+                                          m_key, sort_dir, None)
+
+                for tmpRegReq in rem_set[:page_size + 1]:
+                    rData = RegistrData(
+                        registration = tmpRegReq.registration,
+                        requestid = "%d:" % tmpRegReq.registration.regid,
+                        code = RegistrData.REMINDER
+                    )
+                    rData.sort_key = (rData.username.lower(), tmpRegReq.registration.regid, 0)
+                    result.append(rData)
+
+            adm_count = PrjRole.objects.filter(project = OuterRef('project'))
+            adm_count = adm_count.order_by().values('project')
+            adm_count = adm_count.annotate(cnt = Count('registration', distinct = True))
+
+            prj_set = PrjRequest.objects.annotate(
+                reg_pending = Exists(RegRequest.objects.filter(registration = OuterRef('registration'),
+                                                               flowstatus = RSTATUS_PENDING)),
+                adm_count = Subquery(adm_count.values('cnt'), output_field = IntegerField()),
+                is_admin = Exists(PrjRole.objects.filter(project = OuterRef('project'),
+                                                         registration = OuterRef('registration')))
+            )
+            if codes is not None:
+                prj_set = prj_set.filter(code_query(codes))
+            if f_user:
+                prj_set = prj_set.filter(registration__username=f_user)
+            prj_set = self.get_keyset(prj_set.select_related('registration', 'project'),
+                                      m_key, sort_dir, 'project__projectname')
+
+            for prjReq in prj_set[:page_size + 1]:
 
                 curr_regid = prjReq.registration.regid
 
@@ -96,45 +207,48 @@ class MainView(tables.DataTableView):
                     projectname = prjReq.project.projectname,
                     requestid = "%d:%s" % (curr_regid, prjReq.project.projectname)
                 )
+                rData.sort_key = (rData.username.lower(), curr_regid, 1)
 
                 if prjReq.flowstatus >= PSTATUS_CHK_COMP:
 
                     rData.notes = prjReq.notes if prjReq.flowstatus != PSTATUS_CHK_COMP else None
+                    rData.code = PRJREQ_STATUS_CODES.get(prjReq.flowstatus, 0)
 
-                    if prjReq.flowstatus == PSTATUS_CHK_COMP:
-                        rData.code = RegistrData.CHK_COMP
-                    elif prjReq.flowstatus == PSTATUS_ADM_ELECT:
-                        rData.code = RegistrData.PRO_ADMIN
-                    elif prjReq.flowstatus == PSTATUS_RENEW_ATTEMPT:
-                        rData.code = RegistrData.REN_ATTEMPT
-                    elif prjReq.flowstatus == PSTATUS_RENEW_DISC:
-                        rData.code = RegistrData.REN_DISC
-                    elif prjReq.flowstatus == PSTATUS_RENEW_MEMB:
-                        rData.code = RegistrData.USR_RENEW
-                    elif prjReq.flowstatus == PSTATUS_RENEW_ADMIN:
-                        rData.code = RegistrData.PRJADM_RENEW
-                        if unique_admin(prjReq.registration.username, prjReq.project.projectname):
+                    if prjReq.flowstatus == PSTATUS_RENEW_ADMIN:
+                        if prjReq.is_admin and prjReq.adm_count == 1:
                             rData.notes += " (%s)" % _("Unique administrator")
 
                 elif prjReq.project.projectid:
 
-                    if curr_regid in regid_pending:
+                    if prjReq.reg_pending:
                         rData.code = RegistrData.NEW_USR_EX_PRJ
                     else:
                         rData.code = RegistrData.EX_USR_EX_PRJ
 
                 else:
 
-                    if curr_regid in regid_pending:
+                    if prjReq.reg_pending:
                         rData.code = RegistrData.NEW_USR_NEW_PRJ
                     else:
                         rData.code = RegistrData.EX_USR_NEW_PRJ
 
-                if not rData.requestid in reqTable:
-                    reqTable[rData.requestid] = rData
+                result.append(rData)
+
+        # stable sort: the project requests of the same user keep the
+        # order of the database
+        backward = m_key is not None and sort_dir == 'asc'
+        result.sort(key = lambda x: x.sort_key, reverse = backward)
+
+        has_more = len(result) > page_size
+        result = result[:page_size]
+        if backward:
+            result.reverse()
+            self._has_prev_data = has_more
+            self._has_more_data = True
+        else:
+            self._has_prev_data = m_key is not None
+            self._has_more_data = has_more
 
-        result = list(reqTable.values())
-        result.sort()
         return result
 
 class AbstractCheckView(forms.ModalFormView):
@@ -365,11 +479,11 @@ class DetailsView(forms.ModalFormView):
                     tmpdict['notes'] = tmpres[0].notes
 
                     if tmpres[0].flowstatus == RSTATUS_PENDING:
-                        for x in PrjRequest.objects.filter(registration__regid=regid):
-                            prj_list.append(x.project)
+                        q_set = PrjRequest.objects.filter(registration__regid=regid)
                     else:
-                        for x in Expiration.objects.filter(registration__regid=regid):
-                            prj_list.append(x.project)
+                        q_set = Expiration.objects.filter(registration__regid=regid)
+                    for x in q_set.select_related('project'):
+                        prj_list.append(x.project)
 
                 elif prjname:
                     q_args = {
@@ -388,9 +502,10 @@ class DetailsView(forms.ModalFormView):
                     tmpdict['username'] = reg_item.username
                     tmpdict['fullname'] = reg_item.givenname + " " + reg_item.sn
 
+                prj_info = getProjectInfoMany(self.request, prj_list)
                 for prj_item in prj_list:
                     t_key = 'memberof' if prj_item.projectid else 'newprojects'
-                    tmpdict[t_key].append(getProjectInfo(self.request, prj_item))
+                    tmpdict[t_key].append(prj_info[prj_item.projectname])
 
                 self._object = tmpdict
 
@@ -30,11 +30,8 @@ from openstack_dashboard.dashboards.identity.users import views as baseViews
 
 from openstack_auth_shib.models import Registration
 from openstack_auth_shib.models import Expiration
-from openstack_auth_shib.models import PrjRequest
 from openstack_auth_shib.models import PrjRole
-from openstack_auth_shib.models import PSTATUS_PENDING
-from openstack_auth_shib.models import PSTATUS_CHK_COMP
-from openstack_auth_shib.models import PSTATUS_RENEW_DISC
+from openstack_auth_shib.models import orphan_registrations
 
 from openstack_dashboard import api
 
@@ -169,29 +166,16 @@ class CheckOrphansView(tables.DataTableView):
     def get_data(self):
         result = list()
         with transaction.atomic():
-            # TODO improve queries
-            qset1 = Expiration.objects.all()
-            act_users = set(qset1.values_list('registration', flat = True).distinct())
-
-            qset2 = PrjRequest.objects.exclude(flowstatus = PSTATUS_RENEW_DISC)
-            pend_prjusr = set(qset2.values_list('registration', flat = True).distinct())
-
-            for reg_item in Registration.objects.exclude(regid__in = act_users | pend_prjusr):
-
-                if not reg_item.userid:
-                    continue
-
-                q_args = {
-                    'registration' : reg_item,
-                    'flowstatus__in' : [ PSTATUS_PENDING, PSTATUS_CHK_COMP ],
-                }                
+            orphans = orphan_registrations(with_pending = True)
+            orphans = orphans.exclude(userid__isnull = True).exclude(userid = '')
 
+            for reg_item in orphans:
                 result.append(OrphanData(
                     reg_item.userid,
                     reg_item.username,
                     reg_item.givenname + " " + reg_item.sn,
                     reg_item.expdate,
-                    PrjRequest.objects.filter(**q_args).count() > 0
+                    reg_item.pending
                 ))
         return result
 